@@ -0,0 +1,133 @@
+import copy
+import threading
+
+from app.database.storage import ConversationStorage, campos_de_atividade
+
+
+class CacheDeSessao(ConversationStorage):
+    """
+    Write-through sobre outro backend para uma conexão de chat: o documento e as
+    mensagens da sessão são lidos uma vez por turno e mantidos em memória; toda
+    escrita vai para o backend e também atualiza a cópia local.
+    Outros workers e o /input_message também escrevem na sessão, então a cópia só
+    vale dentro de um turno: o SessionService chama `recarregar` logo depois de
+    obter o lease, e a partir daí ninguém mais escreve até o turno terminar.
+    """
+
+    def __init__(self, base: ConversationStorage):
+        self.base = base
+        self._lock = threading.Lock()
+        self._conversas = {}
+        self._mensagens = {}
+
+    def invalidar(self, user_id: str = None):
+        with self._lock:
+            if user_id is None:
+                self._conversas.clear()
+                self._mensagens.clear()
+            else:
+                self._conversas.pop(user_id, None)
+                self._mensagens.pop(user_id, None)
+
+    def recarregar(self, user_id: str):
+        # a próxima leitura vai ao backend
+        self.invalidar(user_id)
+
+    def _atualizar(self, user_id: str, campos: dict):
+        with self._lock:
+            dados = self._conversas.get(user_id)
+            if dados is not None:
+                dados.update(copy.deepcopy(campos))
+            else:
+                # documento criado agora (merge em conversa inexistente)
+                self._conversas.pop(user_id, None)
+
+    def get_conversa(self, user_id):
+        with self._lock:
+            if user_id in self._conversas:
+                dados = self._conversas[user_id]
+                return copy.deepcopy(dados) if dados is not None else None
+        dados = self.base.get_conversa(user_id)
+        with self._lock:
+            self._conversas[user_id] = copy.deepcopy(dados)
+        return dados
+
+    def criar_conversa(self, user_id, dados, contadores=None):
+        criou = self.base.criar_conversa(user_id, dados, contadores)
+        with self._lock:
+            if criou:
+                self._conversas[user_id] = copy.deepcopy(dados)
+                self._mensagens[user_id] = []
+            elif self._conversas.get(user_id, {}) is None:
+                # já existia no backend, mas o cache achava que não
+                del self._conversas[user_id]
+        return criou
+
+    def salvar_campos(self, user_id, campos):
+        self.base.salvar_campos(user_id, campos)
+        self._atualizar(user_id, campos)
+
+    def aplicar_transicao(self, user_id, campos, contadores):
+        self.base.aplicar_transicao(user_id, campos, contadores)
+        self._atualizar(user_id, campos)
+
+    def ler_contadores(self):
+        return self.base.ler_contadores()
+
+    def consolidar_contadores(self):
+        self.base.consolidar_contadores()
+
+    def get_lead(self, chave):
+        return self.base.get_lead(chave)
+
+    def salvar_lead(self, chave, campos, user_id):
+        self.base.salvar_lead(chave, campos, user_id)
+
+    def incrementar_campos(self, user_id, incrementos):
+        self.base.incrementar_campos(user_id, incrementos)
+        with self._lock:
+            dados = self._conversas.get(user_id)
+            if dados is None:
+                self._conversas.pop(user_id, None)
+                return
+            for campo, valor in incrementos.items():
+                dados[campo] = (dados.get(campo) or 0) + valor
+
+    def adicionar_mensagens(self, user_id, mensagens):
+        if not mensagens:
+            return
+        self.base.adicionar_mensagens(user_id, mensagens)
+        self._atualizar(user_id, campos_de_atividade(mensagens))
+        with self._lock:
+            if user_id in self._mensagens:
+                self._mensagens[user_id].extend({"role": m.get("role"), "content": m.get("content")} for m in mensagens)
+
+    def listar_mensagens(self, user_id, com_uso=False):
+        if com_uso:
+            # o cache guarda só role/content
+            return self.base.listar_mensagens(user_id, com_uso)
+        with self._lock:
+            if user_id in self._mensagens:
+                return [dict(m) for m in self._mensagens[user_id]]
+        mensagens = self.base.listar_mensagens(user_id)
+        with self._lock:
+            self._mensagens[user_id] = [dict(m) for m in mensagens]
+        return mensagens
+
+    def iterar_conversas(self, campo, valores):
+        return self.base.iterar_conversas(campo, valores)
+
+    def substituir_mensagens(self, user_id, mensagens, campos):
+        self.base.substituir_mensagens(user_id, mensagens, campos)
+        self.invalidar(user_id)
+
+    def arquivar_conversas(self, user_ids):
+        self.base.arquivar_conversas(user_ids)
+        for user_id in user_ids:
+            self.invalidar(user_id)
+
+    def adquirir_lease(self, user_id, dono, ttl_segundos):
+        return self.base.adquirir_lease(user_id, dono, ttl_segundos)
+
+    def liberar_lease(self, user_id, dono):
+        self.base.liberar_lease(user_id, dono)
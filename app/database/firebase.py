@@ -1,8 +1,118 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import itertools
+import os
+import threading
 
-cred = credentials.Certificate("app/config/firebase_token.json")
-firebase_admin.initialize_app(cred)
+from dotenv import load_dotenv
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+from google.cloud.firestore_v1.services.firestore import client as firestore_client
+from google.cloud.firestore_v1.services.firestore.transports.grpc import FirestoreGrpcTransport
 
-db = firestore.client()
+load_dotenv()
 
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "app/config/firebase_token.json")
+FIRESTORE_PROJECT_ID = os.getenv("FIRESTORE_PROJECT_ID")
+
+# opções do canal gRPC
+FIRESTORE_POOL_SIZE = int(os.getenv("FIRESTORE_POOL_SIZE", "1"))
+FIRESTORE_KEEPALIVE_MS = int(os.getenv("FIRESTORE_KEEPALIVE_MS", "30000"))
+FIRESTORE_KEEPALIVE_TIMEOUT_MS = int(os.getenv("FIRESTORE_KEEPALIVE_TIMEOUT_MS", "10000"))
+
+# o client é criado na primeira chamada de get_db() e reaproveitado pelo processo;
+# depois de um fork (gunicorn/uvicorn com vários workers) cada processo cria o seu
+_lock = threading.Lock()
+_clients = []
+_proximo = None
+_pid = None
+
+
+def _channel_options() -> list:
+    options = [
+        ("grpc.keepalive_time_ms", FIRESTORE_KEEPALIVE_MS),
+        ("grpc.keepalive_timeout_ms", FIRESTORE_KEEPALIVE_TIMEOUT_MS),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.max_send_message_length", -1),
+        ("grpc.max_receive_message_length", -1),
+    ]
+    if FIRESTORE_POOL_SIZE > 1:
+        # cada canal do pool abre a sua própria conexão
+        options.append(("grpc.use_local_subchannel_pool", 1))
+    return options
+
+
+def _criar_client() -> firestore.Client:
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        # o emulador não precisa de credenciais; a biblioteca já usa um canal inseguro
+        return firestore.Client(
+            project=FIRESTORE_PROJECT_ID or os.getenv("GCLOUD_PROJECT", "demo-verzel"),
+            credentials=AnonymousCredentials()
+        )
+
+    cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+    client = firestore.Client(
+        project=FIRESTORE_PROJECT_ID or cred.project_id,
+        credentials=cred.get_credential()
+    )
+    _usar_canal_proprio(client)
+    return client
+
+
+# atributos internos que BaseClient._firestore_api_helper usa para montar o canal;
+# conferidos com google-cloud-firestore==2.21.0 (versão fixada no requirements.txt)
+_ATRIBUTOS_CLIENT = ("_target", "_credentials", "_client_options", "_client_info", "_firestore_api_internal")
+
+
+def _usar_canal_proprio(client: firestore.Client):
+    """
+    Troca o canal padrão da biblioteca pelo canal com as nossas opções, repetindo o
+    que BaseClient._firestore_api_helper faz na primeira chamada. Se a versão
+    instalada não tiver esses atributos, o client segue com o canal padrão.
+    """
+    faltando = [nome for nome in _ATRIBUTOS_CLIENT if not hasattr(client, nome)]
+    if faltando:
+        print(f"Firestore: usando o canal padrão da biblioteca (atributos ausentes: {faltando})")
+        return
+    if client._firestore_api_internal is not None:
+        # a biblioteca já montou o canal dela
+        return
+    try:
+        channel = FirestoreGrpcTransport.create_channel(
+            client._target,
+            credentials=client._credentials,
+            options=_channel_options()
+        )
+        transport = FirestoreGrpcTransport(host=client._target, channel=channel, client_info=client._client_info)
+        api = firestore_client.FirestoreClient(transport=transport, client_options=client._client_options)
+    except Exception as e:
+        print(f"Firestore: erro ao criar o canal próprio, usando o padrão da biblioteca: {e}")
+        return
+    client._transport = transport
+    client._firestore_api_internal = api
+    firestore_client._client_info = client._client_info
+
+
+def get_db() -> firestore.Client:
+    """Retorna o client do Firestore do processo atual (round-robin quando há pool)."""
+    global _clients, _proximo, _pid
+    if _pid != os.getpid():
+        with _lock:
+            if _pid != os.getpid():
+                _clients = [_criar_client() for _ in range(max(FIRESTORE_POOL_SIZE, 1))]
+                _proximo = itertools.cycle(_clients)
+                _pid = os.getpid()
+    return next(_proximo)
+
+
+def reset_db():
+    """Descarta os clients atuais; o próximo get_db() cria novos (útil em testes)."""
+    global _clients, _proximo, _pid
+    with _lock:
+        for client in _clients:
+            transport = getattr(client, "_transport", None)
+            if transport is not None:
+                transport.close()
+        _clients = []
+        _proximo = None
+        _pid = None
@@ -0,0 +1,175 @@
+import datetime
+import os
+import random
+from urllib.parse import quote
+
+from google.api_core.exceptions import Conflict
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from app.database.firebase import get_db
+from app.database.storage import ConversationStorage, expandir_mensagens
+
+# limite de operações por batch do Firestore
+TAMANHO_BATCH = 500
+# shards dos contadores do funil (cada shard aguenta ~1 escrita/s)
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", "10"))
+
+
+class FirestoreStorage(ConversationStorage):
+    """conversations/{user_id} com a subcoleção messages."""
+
+    def _conversa(self, user_id: str):
+        return get_db().collection("conversations").document(user_id)
+
+    def get_conversa(self, user_id):
+        doc = self._conversa(user_id).get()
+        if not doc.exists:
+            return None
+        return doc.to_dict()
+
+    def _stats(self):
+        return get_db().collection("stats").document("funil")
+
+    def _shard_aleatorio(self):
+        return self._stats().collection("shards").document(str(random.randrange(STATS_SHARDS)))
+
+    def _incrementos(self, contadores: dict) -> dict:
+        return {chave: firestore.Increment(valor) for chave, valor in contadores.items()}
+
+    def criar_conversa(self, user_id, dados, contadores=None):
+        try:
+            # create() falha se o documento já existir, sem precisar de uma leitura antes
+            batch = get_db().batch()
+            batch.create(self._conversa(user_id), dados)
+            if contadores:
+                batch.set(self._shard_aleatorio(), self._incrementos(contadores), merge=True)
+            batch.commit()
+            return True
+        except Conflict:
+            return False
+
+    def aplicar_transicao(self, user_id, campos, contadores):
+        batch = get_db().batch()
+        batch.set(self._conversa(user_id), campos, merge=True)
+        if contadores:
+            batch.set(self._shard_aleatorio(), self._incrementos(contadores), merge=True)
+        batch.commit()
+
+    def ler_contadores(self):
+        # resumo consolidado: uma leitura, independente do número de conversas e de shards
+        doc = self._stats().get()
+        return doc.to_dict() if doc.exists else {}
+
+    def consolidar_contadores(self):
+        totais = {}
+        for shard in self._stats().collection("shards").stream():
+            for chave, valor in shard.to_dict().items():
+                totais[chave] = totais.get(chave, 0) + valor
+        totais["consolidado_em"] = datetime.datetime.now(datetime.timezone.utc)
+        self._stats().set(totais)
+
+    def _lead(self, chave: str):
+        # ids de documento não podem conter "/"
+        return get_db().collection("leads").document(quote(chave, safe="@.+-_"))
+
+    def get_lead(self, chave):
+        doc = self._lead(chave).get()
+        if not doc.exists:
+            return None
+        return doc.to_dict()
+
+    def salvar_lead(self, chave, campos, user_id):
+        self._lead(chave).set(dict(campos, conversas=firestore.ArrayUnion([user_id])), merge=True)
+
+    def salvar_campos(self, user_id, campos):
+        self._conversa(user_id).set(campos, merge=True)
+
+    def incrementar_campos(self, user_id, incrementos):
+        self._conversa(user_id).set({campo: firestore.Increment(valor) for campo, valor in incrementos.items()}, merge=True)
+
+    def adicionar_mensagens(self, user_id, mensagens):
+        if not mensagens:
+            return
+        doc_ref = self._conversa(user_id)
+        messages_ref = doc_ref.collection("messages")
+        batch = get_db().batch()
+        for mensagem in mensagens:
+            batch.set(messages_ref.document(), mensagem)
+        batch.set(doc_ref, campos_de_atividade(mensagens), merge=True)
+        batch.commit()
+
+    def listar_mensagens(self, user_id, com_uso=False):
+        messages_ref = self._conversa(user_id).collection("messages").order_by("dateTime")
+        return expandir_mensagens([doc.to_dict() for doc in messages_ref.stream()], com_uso)
+
+    def iterar_conversas(self, campo, valores):
+        query = get_db().collection("conversations").where(filter=FieldFilter(campo, "in", valores))
+        for doc in query.stream():
+            yield doc.id, doc.to_dict()
+
+    def _em_batches(self, operacoes: list):
+        """Executa [(tipo, ref, dados)] em batches de até TAMANHO_BATCH operações."""
+        for i in range(0, len(operacoes), TAMANHO_BATCH):
+            batch = get_db().batch()
+            for tipo, ref, dados in operacoes[i:i + TAMANHO_BATCH]:
+                if tipo == "set":
+                    batch.set(ref, dados, merge=True)
+                else:
+                    batch.delete(ref)
+            batch.commit()
+
+    def substituir_mensagens(self, user_id, mensagens, campos):
+        doc_ref = self._conversa(user_id)
+        messages_ref = doc_ref.collection("messages")
+        antigas = [doc.reference for doc in messages_ref.select([]).stream()]
+        # grava primeiro as novas e o cabeçalho; as antigas são apagadas em seguida
+        operacoes = [("set", messages_ref.document(), m) for m in mensagens]
+        operacoes.append(("set", doc_ref, campos))
+        operacoes += [("delete", ref, None) for ref in antigas]
+        self._em_batches(operacoes)
+
+    def arquivar_conversas(self, user_ids):
+        db = get_db()
+        arquivo = db.collection("conversations_archive")
+        operacoes = []
+        for user_id in user_ids:
+            doc = self._conversa(user_id).get()
+            if not doc.exists:
+                continue
+            operacoes.append(("set", arquivo.document(user_id), doc.to_dict()))
+            for msg in doc.reference.collection("messages").stream():
+                operacoes.append(("set", arquivo.document(user_id).collection("messages").document(msg.id), msg.to_dict()))
+                operacoes.append(("delete", msg.reference, None))
+            operacoes.append(("delete", doc.reference, None))
+        self._em_batches(operacoes)
+
+    def adquirir_lease(self, user_id, dono, ttl_segundos):
+        db = get_db()
+        # coleção separada para não disputar o documento da conversa
+        lease_ref = db.collection("session_leases").document(user_id)
+
+        @firestore.transactional
+        def _adquirir(transaction):
+            agora = datetime.datetime.now(datetime.timezone.utc)
+            doc = lease_ref.get(transaction=transaction)
+            if doc.exists:
+                atual = doc.to_dict()
+                if atual.get("dono") != dono and atual.get("expira_em") > agora:
+                    return False
+            transaction.set(lease_ref, {"dono": dono, "expira_em": agora + datetime.timedelta(seconds=ttl_segundos)})
+            return True
+
+        return _adquirir(db.transaction())
+
+    def liberar_lease(self, user_id, dono):
+        db = get_db()
+        lease_ref = db.collection("session_leases").document(user_id)
+
+        @firestore.transactional
+        def _liberar(transaction):
+            doc = lease_ref.get(transaction=transaction)
+            if doc.exists and doc.to_dict().get("dono") == dono:
+                transaction.delete(lease_ref)
+
+        _liberar(db.transaction())
@@ -0,0 +1,118 @@
+import copy
+import threading
+import time
+
+from app.database.storage import ConversationStorage, campos_de_atividade, expandir_mensagens
+
+
+class MemoryStorage(ConversationStorage):
+    """Armazenamento em memória do processo, para testes e benchmarks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conversas = {}
+        self._mensagens = {}
+        self._arquivo = {}
+        self._leases = {}
+        self._contadores = {}
+        self._leads = {}
+
+    def get_conversa(self, user_id):
+        with self._lock:
+            dados = self._conversas.get(user_id)
+            return copy.deepcopy(dados) if dados is not None else None
+
+    def _somar_contadores(self, contadores: dict):
+        for chave, valor in (contadores or {}).items():
+            self._contadores[chave] = self._contadores.get(chave, 0) + valor
+
+    def criar_conversa(self, user_id, dados, contadores=None):
+        with self._lock:
+            if user_id in self._conversas:
+                return False
+            self._conversas[user_id] = copy.deepcopy(dados)
+            self._somar_contadores(contadores)
+            return True
+
+    def aplicar_transicao(self, user_id, campos, contadores):
+        with self._lock:
+            self._conversas.setdefault(user_id, {}).update(copy.deepcopy(campos))
+            self._somar_contadores(contadores)
+
+    def ler_contadores(self):
+        with self._lock:
+            return dict(self._contadores)
+
+    def salvar_campos(self, user_id, campos):
+        with self._lock:
+            self._conversas.setdefault(user_id, {}).update(copy.deepcopy(campos))
+
+    def get_lead(self, chave):
+        with self._lock:
+            lead = self._leads.get(chave)
+            return copy.deepcopy(lead) if lead is not None else None
+
+    def salvar_lead(self, chave, campos, user_id):
+        with self._lock:
+            lead = self._leads.setdefault(chave, {})
+            lead.update(copy.deepcopy(campos))
+            conversas = lead.setdefault("conversas", [])
+            if user_id not in conversas:
+                conversas.append(user_id)
+
+    def incrementar_campos(self, user_id, incrementos):
+        with self._lock:
+            dados = self._conversas.setdefault(user_id, {})
+            for campo, valor in incrementos.items():
+                dados[campo] = (dados.get(campo) or 0) + valor
+
+    def adicionar_mensagens(self, user_id, mensagens):
+        if not mensagens:
+            return
+        with self._lock:
+            self._mensagens.setdefault(user_id, []).extend(dict(m) for m in mensagens)
+            self._conversas.setdefault(user_id, {}).update(campos_de_atividade(mensagens))
+
+    def listar_mensagens(self, user_id, com_uso=False):
+        with self._lock:
+            mensagens = sorted(self._mensagens.get(user_id, []), key=lambda m: m["dateTime"])
+            return expandir_mensagens(mensagens, com_uso)
+
+    def iterar_conversas(self, campo, valores):
+        with self._lock:
+            encontradas = [
+                (user_id, copy.deepcopy(dados))
+                for user_id, dados in self._conversas.items()
+                if dados.get(campo) in valores
+            ]
+        yield from encontradas
+
+    def substituir_mensagens(self, user_id, mensagens, campos):
+        with self._lock:
+            self._mensagens[user_id] = [dict(m) for m in mensagens]
+            self._conversas.setdefault(user_id, {}).update(copy.deepcopy(campos))
+
+    def arquivar_conversas(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                if user_id not in self._conversas:
+                    continue
+                self._arquivo[user_id] = {
+                    "dados": self._conversas.pop(user_id),
+                    "mensagens": self._mensagens.pop(user_id, [])
+                }
+
+    def adquirir_lease(self, user_id, dono, ttl_segundos):
+        agora = time.time()
+        with self._lock:
+            atual = self._leases.get(user_id)
+            if atual and atual[0] != dono and atual[1] > agora:
+                return False
+            self._leases[user_id] = (dono, agora + ttl_segundos)
+            return True
+
+    def liberar_lease(self, user_id, dono):
+        with self._lock:
+            atual = self._leases.get(user_id)
+            if atual and atual[0] == dono:
+                del self._leases[user_id]
@@ -0,0 +1,239 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from app.database.storage import ConversationStorage, campos_de_atividade, expandir_mensagens
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    role TEXT,
+    content TEXT,
+    date_time TEXT NOT NULL,
+    usage TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_id, date_time);
+CREATE TABLE IF NOT EXISTS funnel_counters (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leads (
+    chave TEXT PRIMARY KEY,
+    dados TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_leases (
+    user_id TEXT PRIMARY KEY,
+    dono TEXT NOT NULL,
+    expira_em REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations_archive (
+    user_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages_archive (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    role TEXT,
+    content TEXT,
+    date_time TEXT NOT NULL,
+    usage TEXT
+);
+"""
+
+# colunas acrescentadas depois da primeira versão do schema (bancos já existentes);
+# entram no fim da tabela, então messages e messages_archive continuam com a mesma ordem
+MIGRACOES = [
+    ("messages", "usage", "ALTER TABLE messages ADD COLUMN usage TEXT"),
+    ("messages_archive", "usage", "ALTER TABLE messages_archive ADD COLUMN usage TEXT"),
+]
+
+# as consultas são sempre as mesmas strings parametrizadas, então o sqlite3
+# reaproveita os statements preparados (cache por conexão)
+SQL_GET_CONVERSA = "SELECT dados FROM conversations WHERE user_id = ?"
+SQL_CRIAR_CONVERSA = "INSERT INTO conversations (user_id, dados) VALUES (?, ?) ON CONFLICT (user_id) DO NOTHING"
+SQL_SALVAR_CAMPOS = (
+    "INSERT INTO conversations (user_id, dados) VALUES (?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET dados = json_patch(dados, excluded.dados)"
+)
+SQL_INCREMENTAR_CAMPO = (
+    "UPDATE conversations SET dados = json_set(dados, ?, coalesce(json_extract(dados, ?), 0) + ?) "
+    "WHERE user_id = ?"
+)
+SQL_ADICIONAR_MENSAGEM = "INSERT INTO messages (user_id, role, content, date_time, usage) VALUES (?, ?, ?, ?, ?)"
+SQL_LISTAR_MENSAGENS = "SELECT role, content, usage FROM messages WHERE user_id = ? ORDER BY date_time, id"
+SQL_ITERAR_CONVERSAS = "SELECT user_id, dados FROM conversations WHERE json_extract(dados, ?) IN (SELECT value FROM json_each(?))"
+SQL_APAGAR_MENSAGENS = "DELETE FROM messages WHERE user_id = ?"
+SQL_ARQUIVAR_CONVERSA = "INSERT OR REPLACE INTO conversations_archive SELECT * FROM conversations WHERE user_id = ?"
+SQL_ARQUIVAR_MENSAGENS = "INSERT OR REPLACE INTO messages_archive SELECT * FROM messages WHERE user_id = ?"
+SQL_APAGAR_CONVERSA = "DELETE FROM conversations WHERE user_id = ?"
+SQL_ADQUIRIR_LEASE = (
+    "INSERT INTO session_leases (user_id, dono, expira_em) VALUES (?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em "
+    "WHERE session_leases.dono = excluded.dono OR session_leases.expira_em < ?"
+)
+SQL_SOMAR_CONTADOR = (
+    "INSERT INTO funnel_counters (chave, valor) VALUES (?, ?) "
+    "ON CONFLICT (chave) DO UPDATE SET valor = valor + excluded.valor"
+)
+SQL_LER_CONTADORES = "SELECT chave, valor FROM funnel_counters"
+SQL_GET_LEAD = "SELECT dados FROM leads WHERE chave = ?"
+SQL_SALVAR_LEAD = "INSERT OR REPLACE INTO leads (chave, dados) VALUES (?, ?)"
+SQL_LIBERAR_LEASE = "DELETE FROM session_leases WHERE user_id = ? AND dono = ?"
+
+
+def _json_default(valor):
+    if isinstance(valor, (datetime.datetime, datetime.date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor)}")
+
+
+def _dumps(dados: dict) -> str:
+    return json.dumps(dados, default=_json_default, ensure_ascii=False)
+
+
+def _linha_mensagem(user_id: str, m: dict) -> tuple:
+    usage = _dumps(m["usage"]) if m.get("usage") else None
+    return (user_id, m.get("role"), m.get("content"), _json_default(m["dateTime"]), usage)
+
+
+class SQLiteStorage(ConversationStorage):
+    """
+    Armazenamento local em SQLite (modo WAL), uma conexão por thread.
+    Datas são gravadas como texto ISO 8601.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+        self._migrar()
+
+    def _migrar(self):
+        conn = self._conn()
+        for tabela, coluna, sql in MIGRACOES:
+            colunas = [row[1] for row in conn.execute(f"PRAGMA table_info({tabela})")]
+            if coluna not in colunas:
+                conn.execute(sql)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_conversa(self, user_id):
+        row = self._conn().execute(SQL_GET_CONVERSA, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def criar_conversa(self, user_id, dados, contadores=None):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            criou = conn.execute(SQL_CRIAR_CONVERSA, (user_id, _dumps(dados))).rowcount == 1
+            if criou and contadores:
+                conn.executemany(SQL_SOMAR_CONTADOR, list(contadores.items()))
+        return criou
+
+    def aplicar_transicao(self, user_id, campos, contadores):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(SQL_SALVAR_CAMPOS, (user_id, _dumps(campos)))
+            conn.executemany(SQL_SOMAR_CONTADOR, list(contadores.items()))
+
+    def ler_contadores(self):
+        return dict(self._conn().execute(SQL_LER_CONTADORES).fetchall())
+
+    def salvar_campos(self, user_id, campos):
+        # json_patch faz o merge dentro do próprio UPDATE (campos com None são removidos)
+        self._conn().execute(SQL_SALVAR_CAMPOS, (user_id, _dumps(campos)))
+
+    def get_lead(self, chave):
+        row = self._conn().execute(SQL_GET_LEAD, (chave,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def salvar_lead(self, chave, campos, user_id):
+        conn = self._conn()
+        with conn:
+            # IMMEDIATE: a leitura e a escrita do lead acontecem sob o mesmo lock de escrita
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(SQL_GET_LEAD, (chave,)).fetchone()
+            lead = json.loads(row[0]) if row else {}
+            lead.update(json.loads(_dumps(campos)))
+            conversas = lead.setdefault("conversas", [])
+            if user_id not in conversas:
+                conversas.append(user_id)
+            conn.execute(SQL_SALVAR_LEAD, (chave, _dumps(lead)))
+
+    def incrementar_campos(self, user_id, incrementos):
+        conn = self._conn()
+        rows = [(f"$.{campo}", f"$.{campo}", valor, user_id) for campo, valor in incrementos.items()]
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(SQL_CRIAR_CONVERSA, (user_id, "{}"))
+            conn.executemany(SQL_INCREMENTAR_CAMPO, rows)
+
+    def adicionar_mensagens(self, user_id, mensagens):
+        if not mensagens:
+            return
+        conn = self._conn()
+        rows = [_linha_mensagem(user_id, m) for m in mensagens]
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(SQL_ADICIONAR_MENSAGEM, rows)
+            conn.execute(SQL_SALVAR_CAMPOS, (user_id, _dumps(campos_de_atividade(mensagens))))
+
+    def listar_mensagens(self, user_id, com_uso=False):
+        rows = self._conn().execute(SQL_LISTAR_MENSAGENS, (user_id,)).fetchall()
+        mensagens = [
+            {"role": role, "content": content, "usage": json.loads(usage) if usage else None}
+            for role, content, usage in rows
+        ]
+        return expandir_mensagens(mensagens, com_uso)
+
+    def iterar_conversas(self, campo, valores):
+        # lê tudo antes para não manter o SELECT aberto enquanto o chamador escreve
+        rows = self._conn().execute(SQL_ITERAR_CONVERSAS, (f"$.{campo}", json.dumps(valores))).fetchall()
+        for user_id, dados in rows:
+            yield user_id, json.loads(dados)
+
+    def substituir_mensagens(self, user_id, mensagens, campos):
+        conn = self._conn()
+        rows = [_linha_mensagem(user_id, m) for m in mensagens]
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(SQL_APAGAR_MENSAGENS, (user_id,))
+            conn.executemany(SQL_ADICIONAR_MENSAGEM, rows)
+            conn.execute(SQL_SALVAR_CAMPOS, (user_id, _dumps(campos)))
+
+    def arquivar_conversas(self, user_ids):
+        conn = self._conn()
+        params = [(user_id,) for user_id in user_ids]
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(SQL_ARQUIVAR_CONVERSA, params)
+            conn.executemany(SQL_ARQUIVAR_MENSAGENS, params)
+            conn.executemany(SQL_APAGAR_MENSAGENS, params)
+            conn.executemany(SQL_APAGAR_CONVERSA, params)
+
+    def adquirir_lease(self, user_id, dono, ttl_segundos):
+        agora = time.time()
+        cursor = self._conn().execute(SQL_ADQUIRIR_LEASE, (user_id, dono, agora + ttl_segundos, agora))
+        return cursor.rowcount == 1
+
+    def liberar_lease(self, user_id, dono):
+        self._conn().execute(SQL_LIBERAR_LEASE, (user_id, dono))
@@ -0,0 +1,272 @@
+import base64
+import json
+import os
+import queue
+import threading
+import traceback
+import zlib
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# firestore | sqlite | memory
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+# backend opcional que recebe uma cópia assíncrona das escritas
+STORAGE_REPLICA = os.getenv("STORAGE_REPLICA")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "conversations.db")
+
+# papel da mensagem que guarda o log compactado de uma conversa
+TRANSCRICAO = "__transcricao__"
+
+
+def campos_de_atividade(mensagens: list) -> dict:
+    """Última atividade da conversa, gravada no documento junto com as mensagens novas."""
+    return {"atualizado_em": max(m["dateTime"] for m in mensagens)}
+
+
+def compactar_mensagens(mensagens: list) -> str:
+    """Serializa [{role, content, usage?}] em JSON comprimido (zlib + base64)."""
+    dados = json.dumps(mensagens, ensure_ascii=False).encode("utf-8")
+    return base64.b64encode(zlib.compress(dados, 9)).decode("ascii")
+
+
+def expandir_mensagens(mensagens: list, com_uso: bool = False) -> list:
+    """
+    Retorna [{role, content}] abrindo as transcrições compactadas; com `com_uso`,
+    as respostas do assistente trazem também o `usage` do turno.
+    """
+    resultado = []
+    for m in mensagens:
+        if m.get("role") == TRANSCRICAO:
+            itens = json.loads(zlib.decompress(base64.b64decode(m["content"])))
+        else:
+            itens = [m]
+        for item in itens:
+            mensagem = {"role": item.get("role"), "content": item.get("content")}
+            if com_uso and item.get("usage"):
+                mensagem["usage"] = item["usage"]
+            resultado.append(mensagem)
+    return resultado
+
+
+class ConversationStorage():
+    """
+    Interface de armazenamento das conversas.
+    Cada conversa tem um documento (cabeçalho + campos coletados, incluindo a etapa)
+    e um log de mensagens ordenado por data.
+    """
+
+    def get_conversa(self, user_id: str) -> dict | None:
+        """Retorna os campos da conversa ou None se ela não existir."""
+        raise NotImplementedError
+
+    def criar_conversa(self, user_id: str, dados: dict, contadores: dict = None) -> bool:
+        """
+        Cria a conversa com `dados` se ela ainda não existir. Retorna True se criou.
+        `contadores` só são somados quando a conversa é de fato criada.
+        """
+        raise NotImplementedError
+
+    def salvar_campos(self, user_id: str, campos: dict):
+        """Faz merge de `campos` no documento da conversa (cria se não existir)."""
+        raise NotImplementedError
+
+    def aplicar_transicao(self, user_id: str, campos: dict, contadores: dict):
+        """Faz merge de `campos` na conversa e soma `contadores` do funil na mesma escrita."""
+        raise NotImplementedError
+
+    def ler_contadores(self) -> dict:
+        """Contadores do funil com uma única leitura."""
+        raise NotImplementedError
+
+    def consolidar_contadores(self):
+        """Atualiza o resumo lido por ler_contadores (no-op quando não há shards)."""
+
+    def get_lead(self, chave: str) -> dict | None:
+        """Lead já conhecido pela chave do índice (email normalizado), ou None."""
+        raise NotImplementedError
+
+    def salvar_lead(self, chave: str, campos: dict, user_id: str):
+        """Faz merge de `campos` no lead e acrescenta `user_id` às conversas dele."""
+        raise NotImplementedError
+
+    def incrementar_campos(self, user_id: str, incrementos: dict):
+        """Soma atomicamente os valores de `incrementos` aos campos numéricos da conversa."""
+        raise NotImplementedError
+
+    def adicionar_mensagens(self, user_id: str, mensagens: list):
+        """
+        Acrescenta mensagens ({role, content, dateTime}) ao log da conversa e, na
+        mesma escrita, marca `atualizado_em` no documento (última atividade).
+        """
+        raise NotImplementedError
+
+    def listar_mensagens(self, user_id: str, com_uso: bool = False) -> list:
+        """
+        Mensagens da conversa ({role, content}) em ordem cronológica. Com `com_uso`,
+        inclui o `usage` das respostas (não vai para o contexto do modelo).
+        """
+        raise NotImplementedError
+
+    def iterar_conversas(self, campo: str, valores: list):
+        """Gera (user_id, dados) das conversas em que `campo` está em `valores`."""
+        raise NotImplementedError
+
+    def substituir_mensagens(self, user_id: str, mensagens: list, campos: dict):
+        """Troca todo o log de mensagens por `mensagens` e faz merge de `campos`."""
+        raise NotImplementedError
+
+    def arquivar_conversas(self, user_ids: list):
+        """Move as conversas (documento e mensagens) para o arquivo."""
+        raise NotImplementedError
+
+    def adquirir_lease(self, user_id: str, dono: str, ttl_segundos: int) -> bool:
+        """Reserva a sessão para `dono` se ela estiver livre ou com lease expirado."""
+        raise NotImplementedError
+
+    def liberar_lease(self, user_id: str, dono: str):
+        """Libera o lease se ele ainda pertencer a `dono`."""
+        raise NotImplementedError
+
+    def recarregar(self, user_id: str):
+        """Descarta cópias locais da conversa, se houver (caches); os backends leem sempre do storage."""
+
+    def get_resultado_turno(self, user_id: str, chave: str):
+        """Resposta já gerada para a chave de idempotência (apenas o último turno é guardado)."""
+        dados = self.get_conversa(user_id) or {}
+        ultimo = dados.get("ultimo_turno") or {}
+        if ultimo.get("chave") == chave:
+            return ultimo.get("resposta")
+        return None
+
+    def salvar_resultado_turno(self, user_id: str, chave: str, resposta):
+        self.salvar_campos(user_id, {"ultimo_turno": {"chave": chave, "resposta": resposta}})
+
+    def get_etapa(self, user_id: str) -> str | None:
+        dados = self.get_conversa(user_id)
+        if dados is None:
+            return None
+        return dados.get("etapa_atual")
+
+    def set_etapa(self, user_id: str, etapa: str):
+        self.salvar_campos(user_id, {"etapa_atual": etapa})
+
+
+class ReplicaAssincrona(ConversationStorage):
+    """
+    Lê e escreve no backend principal (ex.: SQLite local da região) e repassa
+    as escritas para a réplica em uma thread de fundo, sem bloquear a requisição.
+    """
+
+    def __init__(self, principal: ConversationStorage, replica: ConversationStorage, tamanho_fila: int = 10000):
+        self.principal = principal
+        self.replica = replica
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self._thread = threading.Thread(target=self._replicar, daemon=True)
+        self._thread.start()
+
+    def _enfileirar(self, metodo: str, *args):
+        try:
+            self._fila.put_nowait((metodo, args))
+        except queue.Full:
+            print(f"Fila de replicação cheia, descartando {metodo}")
+
+    def _replicar(self):
+        while True:
+            metodo, args = self._fila.get()
+            try:
+                getattr(self.replica, metodo)(*args)
+            except Exception as e:
+                print(f"Erro ao replicar {metodo}: {e}")
+                traceback.print_exc()
+            finally:
+                self._fila.task_done()
+
+    def get_conversa(self, user_id):
+        return self.principal.get_conversa(user_id)
+
+    def criar_conversa(self, user_id, dados, contadores=None):
+        criou = self.principal.criar_conversa(user_id, dados, contadores)
+        if criou:
+            self._enfileirar("criar_conversa", user_id, dict(dados), contadores)
+        return criou
+
+    def aplicar_transicao(self, user_id, campos, contadores):
+        self.principal.aplicar_transicao(user_id, campos, contadores)
+        self._enfileirar("aplicar_transicao", user_id, dict(campos), dict(contadores))
+
+    def ler_contadores(self):
+        return self.principal.ler_contadores()
+
+    def consolidar_contadores(self):
+        self.principal.consolidar_contadores()
+
+    def get_lead(self, chave):
+        return self.principal.get_lead(chave)
+
+    def salvar_lead(self, chave, campos, user_id):
+        self.principal.salvar_lead(chave, campos, user_id)
+        self._enfileirar("salvar_lead", chave, dict(campos), user_id)
+
+    def salvar_campos(self, user_id, campos):
+        self.principal.salvar_campos(user_id, campos)
+        self._enfileirar("salvar_campos", user_id, dict(campos))
+
+    def incrementar_campos(self, user_id, incrementos):
+        self.principal.incrementar_campos(user_id, incrementos)
+        self._enfileirar("incrementar_campos", user_id, dict(incrementos))
+
+    def adicionar_mensagens(self, user_id, mensagens):
+        self.principal.adicionar_mensagens(user_id, mensagens)
+        self._enfileirar("adicionar_mensagens", user_id, [dict(m) for m in mensagens])
+
+    def listar_mensagens(self, user_id, com_uso=False):
+        return self.principal.listar_mensagens(user_id, com_uso)
+
+    def iterar_conversas(self, campo, valores):
+        return self.principal.iterar_conversas(campo, valores)
+
+    def substituir_mensagens(self, user_id, mensagens, campos):
+        self.principal.substituir_mensagens(user_id, mensagens, campos)
+        self._enfileirar("substituir_mensagens", user_id, [dict(m) for m in mensagens], dict(campos))
+
+    def arquivar_conversas(self, user_ids):
+        self.principal.arquivar_conversas(user_ids)
+        self._enfileirar("arquivar_conversas", list(user_ids))
+
+    def adquirir_lease(self, user_id, dono, ttl_segundos):
+        return self.principal.adquirir_lease(user_id, dono, ttl_segundos)
+
+    def liberar_lease(self, user_id, dono):
+        self.principal.liberar_lease(user_id, dono)
+
+
+def criar_storage(backend: str) -> ConversationStorage:
+    if backend == "firestore":
+        from app.database.firestore_storage import FirestoreStorage
+        return FirestoreStorage()
+    if backend == "sqlite":
+        from app.database.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH)
+    if backend == "memory":
+        from app.database.memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"STORAGE_BACKEND inválido: {backend}")
+
+
+_storage = None
+_lock = threading.Lock()
+
+
+def get_storage() -> ConversationStorage:
+    """Backend configurado em STORAGE_BACKEND (uma instância por processo)."""
+    global _storage
+    if _storage is None:
+        with _lock:
+            if _storage is None:
+                storage = criar_storage(STORAGE_BACKEND)
+                if STORAGE_REPLICA:
+                    storage = ReplicaAssincrona(storage, criar_storage(STORAGE_REPLICA))
+                _storage = storage
+    return _storage
@@ -0,0 +1,126 @@
+"""
+Compactação e arquivamento das conversas finalizadas.
+
+Uso:
+    python -m app.jobs.compactacao --arquivar-apos-dias 90
+"""
+import argparse
+import datetime
+import traceback
+
+from app.database.storage import ConversationStorage, TRANSCRICAO, compactar_mensagens, get_storage
+from app.services.session_service import SessaoOcupadaError, SessionService
+
+STATUS_FINALIZADOS = ["agendado"]
+ETAPAS_FINALIZADAS = ["finalizado"]
+
+
+def _conversas_finalizadas(storage: ConversationStorage):
+    vistos = set()
+    for campo, valores in (("status", STATUS_FINALIZADOS), ("etapa_atual", ETAPAS_FINALIZADAS)):
+        for user_id, dados in storage.iterar_conversas(campo, valores):
+            if user_id not in vistos:
+                vistos.add(user_id)
+                yield user_id, dados
+
+
+def _mensagem_util(mensagem: dict) -> bool:
+    """Descarta mensagens vazias (reentradas sintéticas do send_message)."""
+    content = mensagem.get("content")
+    return isinstance(content, str) and content.strip() != ""
+
+
+def _to_datetime(valor):
+    if isinstance(valor, str):
+        valor = datetime.datetime.fromisoformat(valor.replace("Z", "+00:00"))
+    if isinstance(valor, datetime.datetime) and valor.tzinfo is None:
+        valor = valor.replace(tzinfo=datetime.timezone.utc)
+    return valor
+
+
+def compactar_conversa(storage: ConversationStorage, user_id: str, dados: dict) -> bool:
+    """Troca o log de mensagens por uma única transcrição comprimida. Retorna True se compactou."""
+    # o uso do modelo em cada resposta vai junto para a transcrição
+    mensagens = storage.listar_mensagens(user_id, com_uso=True)
+    uteis = [m for m in mensagens if _mensagem_util(m)]
+    if dados.get("compactado_em") and dados.get("mensagens_compactadas") == len(mensagens) == len(uteis):
+        # nada novo desde a última compactação
+        return False
+
+    # a transcrição fica na data de criação da conversa, antes de qualquer mensagem nova
+    criado_em = dados.get("created_at") or datetime.datetime.utcnow()
+    if isinstance(criado_em, str):
+        criado_em = datetime.datetime.fromisoformat(criado_em)
+    transcricao = {"role": TRANSCRICAO, "content": compactar_mensagens(uteis), "dateTime": criado_em}
+    storage.substituir_mensagens(user_id, [transcricao], {
+        "compactado_em": datetime.datetime.utcnow(),
+        "mensagens_compactadas": len(uteis)
+    })
+    print(f"Compactou {user_id}: {len(mensagens)} -> {len(uteis)} mensagens")
+    return True
+
+
+def _compactar_com_lease(sessoes: SessionService, storage: ConversationStorage, user_id: str) -> tuple:
+    """
+    Compacta segurando o lease da sessão, como um turno: uma mensagem gravada entre
+    a leitura do log e a troca pela transcrição seria apagada sem entrar nela.
+    Retorna (compactou, última atividade).
+    """
+    def turno():
+        # relido com o lease: o documento da consulta pode estar desatualizado
+        dados = storage.get_conversa(user_id)
+        if dados is None:
+            return False, None
+        if not dados.get("atualizado_em"):
+            # conversa anterior ao campo: a atividade passa a contar de agora
+            storage.salvar_campos(user_id, {"atualizado_em": datetime.datetime.utcnow()})
+            return compactar_conversa(storage, user_id, dados), None
+        return compactar_conversa(storage, user_id, dados), _to_datetime(dados["atualizado_em"])
+
+    return sessoes.executar_turno(user_id, turno, storage=storage)
+
+
+def compactar_conversas(storage: ConversationStorage = None, arquivar_apos_dias: int = 90, tamanho_lote: int = 200) -> dict:
+    """
+    Percorre as conversas finalizadas/agendadas, compacta o log de mensagens
+    e arquiva em lotes as que estão sem mensagens novas há mais de `arquivar_apos_dias`.
+    Conversas com um turno em andamento ficam para a próxima execução.
+    """
+    storage = storage or get_storage()
+    sessoes = SessionService(storage)
+    limite = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=arquivar_apos_dias)
+    resumo = {"compactadas": 0, "arquivadas": 0, "ocupadas": 0, "erros": 0}
+    lote = []
+
+    for user_id, dados in _conversas_finalizadas(storage):
+        try:
+            compactou, atualizado_em = _compactar_com_lease(sessoes, storage, user_id)
+            if compactou:
+                resumo["compactadas"] += 1
+            if atualizado_em and atualizado_em < limite:
+                lote.append(user_id)
+            if len(lote) >= tamanho_lote:
+                storage.arquivar_conversas(lote)
+                resumo["arquivadas"] += len(lote)
+                lote = []
+        except SessaoOcupadaError:
+            resumo["ocupadas"] += 1
+        except Exception as e:
+            resumo["erros"] += 1
+            print(f"Erro ao compactar {user_id}: {e}")
+            traceback.print_exc()
+
+    if lote:
+        storage.arquivar_conversas(lote)
+        resumo["arquivadas"] += len(lote)
+
+    print(f"Compactação concluída: {resumo}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compacta e arquiva conversas finalizadas.")
+    parser.add_argument("--arquivar-apos-dias", type=int, default=90)
+    parser.add_argument("--tamanho-lote", type=int, default=200)
+    args = parser.parse_args()
+    compactar_conversas(arquivar_apos_dias=args.arquivar_apos_dias, tamanho_lote=args.tamanho_lote)
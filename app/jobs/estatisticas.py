@@ -0,0 +1,34 @@
+"""
+Consolidação dos contadores do funil (soma os shards no documento lido pelo /stats).
+
+Uso:
+    python -m app.jobs.estatisticas --intervalo 60
+"""
+import argparse
+import time
+import traceback
+
+from app.database.storage import ConversationStorage, get_storage
+
+
+def consolidar_estatisticas(storage: ConversationStorage = None):
+    storage = storage or get_storage()
+    storage.consolidar_contadores()
+    contadores = storage.ler_contadores()
+    print(f"Contadores do funil consolidados: {contadores}")
+    return contadores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consolida os contadores do funil.")
+    parser.add_argument("--intervalo", type=int, default=0, help="segundos entre consolidações (0 = roda uma vez)")
+    args = parser.parse_args()
+    while True:
+        try:
+            consolidar_estatisticas()
+        except Exception as e:
+            print(f"Erro ao consolidar contadores: {e}")
+            traceback.print_exc()
+        if args.intervalo <= 0:
+            break
+        time.sleep(args.intervalo)
@@ -0,0 +1,53 @@
+"""
+Cria no Pipefy os cards que ficaram pendentes enquanto ele estava fora do ar.
+
+Uso:
+    python -m app.jobs.pipefy_pendentes --intervalo 300
+"""
+import argparse
+import time
+import traceback
+
+from app.database.storage import ConversationStorage, get_storage
+from app.services.pipefy_service import PipefyService
+
+
+def criar_cards_pendentes(storage: ConversationStorage = None, pipefy: PipefyService = None):
+    storage = storage or get_storage()
+    pipefy = pipefy or PipefyService()
+    resumo = {"criados": 0, "pendentes": 0, "erros": 0}
+
+    for user_id, dados in storage.iterar_conversas("pipefy_pendente", [True]):
+        resultado = pipefy.criar_card(dados, dados.get("event_link"))
+        if resultado.get("success"):
+            storage.salvar_campos(user_id, {
+                "pipefy_card_id": resultado.get("card_id", ""),
+                "pipefy_card_url": resultado.get("card_url", ""),
+                "pipefy_pendente": False
+            })
+            resumo["criados"] += 1
+        elif resultado.get("indisponivel"):
+            # continua fora do ar: fica para a próxima execução
+            resumo["pendentes"] += 1
+        else:
+            # erro que não se resolve tentando de novo (ex.: credenciais, validação)
+            storage.salvar_campos(user_id, {"pipefy_pendente": False, "pipefy_erro": resultado.get("error", "")})
+            resumo["erros"] += 1
+
+    print(f"Cards pendentes do Pipefy: {resumo}")
+    return resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cria os cards pendentes do Pipefy.")
+    parser.add_argument("--intervalo", type=int, default=0, help="segundos entre execuções (0 = roda uma vez)")
+    args = parser.parse_args()
+    while True:
+        try:
+            criar_cards_pendentes()
+        except Exception as e:
+            print(f"Erro ao criar cards pendentes: {e}")
+            traceback.print_exc()
+        if args.intervalo <= 0:
+            break
+        time.sleep(args.intervalo)
@@ -1,28 +1,79 @@
-from fastapi import APIRouter
-from random import randint
+import math
+from fastapi import APIRouter, Header, HTTPException, WebSocket
+from fastapi.responses import PlainTextResponse
 from app.services.openai_service import OpenAIService, FirebaseOrganizer
+from app.services.session_service import (
+    session_service, SessaoOcupadaError, nova_sessao, eh_sessao_legada, migrar_sessao_legada
+)
+from app.services.llm_scheduler import FilaCheiaError
+from app.services.metrics_service import metrics
+from app.services.llm_policy import relatorio_etapas
+from app.services.chat_ws_service import ConexaoChat
 
 router = APIRouter()
 
 @router.get("/input_message")
-def input_message(message_received: str, session_id: str = None):
+def input_message(message_received: str, session_id: str = None, request_id: str = None,
+                  idempotency_key: str = Header(None)):
     if not session_id:
-        session_id = f"visitor_{randint(0, 10000)}"
+        session_id = nova_sessao()
+    elif eh_sessao_legada(session_id):
+        # o frontend passa a usar o id novo devolvido na resposta
+        try:
+            session_id = session_service.executar_turno(session_id, lambda: migrar_sessao_legada(session_id))
+        except SessaoOcupadaError:
+            raise HTTPException(status_code=409, detail="Ainda estou processando a mensagem anterior. Tente novamente.")
 
-    o = OpenAIService()
-    f = FirebaseOrganizer()
+    def turno():
+        o = OpenAIService()
+        return o.send_message(
+            session_id,
+            {"role": "user", "content": message_received}
+        )
 
-    response = o.send_message(
-        session_id,
-        {"role": "user", "content": message_received}
-    )
+    # um turno por sessão; reenvios com a mesma chave recebem a mesma resposta
+    try:
+        response = session_service.executar_turno(session_id, turno, chave=idempotency_key or request_id)
+    except SessaoOcupadaError:
+        raise HTTPException(status_code=409, detail="Ainda estou processando a mensagem anterior. Tente novamente.")
+    except FilaCheiaError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Estou atendendo muitas pessoas agora. Tente novamente em instantes.",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
 
     # f.save_message(session_id, message_received, response)
     return {"session_id": session_id, "response": response}
 
 
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket, session_id: str = None, ultimo_seq: int = 0, versao: str = ""):
+    # uma conexão por sessão; o histórico a partir de `ultimo_seq` é reenviado na reconexão
+    await ConexaoChat(websocket, session_id, ultimo_seq, versao).atender()
+
+
 @router.get("/get_messages")
 def get_messages(session_id: str):
     f = FirebaseOrganizer()
+    if eh_sessao_legada(session_id) and f.get_dados_cliente(session_id).get("migrado_para"):
+        # id antigo já migrado por outro visitante: não expõe o histórico dele
+        return {"messages": []}
     messages = f.get_messages(session_id) 
-    return {"messages": messages}
\ No newline at end of file
+    return {"messages": messages}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.exportar()
+
+
+@router.get("/relatorio_etapas")
+def get_relatorio_etapas():
+    return {"etapas": relatorio_etapas()}
+
+
+@router.get("/stats")
+def get_stats(consolidar: bool = False):
+    f = FirebaseOrganizer()
+    return f.get_estatisticas(consolidar=consolidar)
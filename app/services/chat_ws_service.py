@@ -0,0 +1,229 @@
+import asyncio
+import os
+import threading
+import time
+import traceback
+
+from dotenv import load_dotenv
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from app.database.cache_storage import CacheDeSessao
+from app.database.storage import get_storage
+from app.services.llm_scheduler import FilaCheiaError
+from app.services.metrics_service import metrics
+from app.services.openai_service import OpenAIService
+from app.services.session_service import (
+    session_service, SessaoOcupadaError, nova_sessao, eh_sessao_legada, migrar_sessao_legada
+)
+
+load_dotenv()
+
+# intervalo entre pings do servidor; sem resposta em 3 intervalos a conexão é encerrada
+WS_HEARTBEAT = float(os.getenv("WS_HEARTBEAT", "20"))
+
+# códigos de fechamento próprios (faixa 4000-4999)
+FECHAMENTO_SUBSTITUIDA = 4000
+FECHAMENTO_SEM_HEARTBEAT = 4001
+
+MENSAGEM_OCUPADA = "Ainda estou processando a mensagem anterior. Tente novamente."
+MENSAGEM_FILA_CHEIA = "Estou atendendo muitas pessoas agora. Tente novamente em instantes."
+
+# conexão ativa de cada sessão neste processo
+_conexoes = {}
+_conexoes_lock = threading.Lock()
+
+
+def versao_historico(dados: dict) -> str:
+    """Muda a cada compactação, que troca o log de mensagens (e as posições) por uma transcrição."""
+    compactado_em = dados.get("compactado_em")
+    if hasattr(compactado_em, "isoformat"):
+        return compactado_em.isoformat()
+    return str(compactado_em or "")
+
+
+class ConexaoChat():
+    """
+    Uma conexão WebSocket de chat. A sessão fica em um CacheDeSessao: cada turno
+    relê a conversa uma vez (depois de obter o lease) em vez de a cada consulta.
+
+    Eventos enviados:
+      {"type": "session", "session_id"}                  id criado ou migrado
+      {"type": "message", "seq", "role", "content"}      mensagem do histórico (seq começa em 1)
+      {"type": "etapa", "etapa"}                         etapa atual / mudança de etapa
+      {"type": "sincronizado", "seq", "versao"}          fim do histórico pendente
+      {"type": "reset", "versao"}                        o cliente deve descartar o histórico (seq desconhecido)
+      {"type": "error", "detail", "request_id"?, "retry_after"?}
+      {"type": "ping"} / {"type": "pong"}
+    Eventos recebidos:
+      {"type": "message", "content", "request_id"?}
+      {"type": "ping"} / {"type": "pong"}
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str = None, ultimo_seq: int = 0, versao: str = ""):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.ultimo_seq = ultimo_seq
+        # versão do histórico que o cliente tinha (os seq valem só dentro de uma versão)
+        self.versao_cliente = versao or ""
+        self._versao = None
+        self.storage = CacheDeSessao(get_storage())
+        self._service = None
+        self._seq = 0
+        self._etapa = None
+        self._envio = asyncio.Lock()
+        self._fila = asyncio.Queue()
+        self._recebido_em = time.monotonic()
+
+    async def enviar(self, evento: dict):
+        async with self._envio:
+            await self.websocket.send_json(evento)
+
+    # --- registro de uma conexão por sessão ---
+
+    async def _registrar(self):
+        with _conexoes_lock:
+            anterior = _conexoes.get(self.session_id)
+            _conexoes[self.session_id] = self
+            metrics.definir("ws_conexoes", len(_conexoes))
+        if anterior is not None and anterior is not self:
+            # a mesma sessão aberta em outra aba/reconexão: só a mais nova continua
+            try:
+                await anterior.websocket.close(code=FECHAMENTO_SUBSTITUIDA)
+            except Exception:
+                pass
+
+    def _desregistrar(self):
+        with _conexoes_lock:
+            if _conexoes.get(self.session_id) is self:
+                del _conexoes[self.session_id]
+            metrics.definir("ws_conexoes", len(_conexoes))
+
+    # --- sincronização ---
+
+    def _carregar(self):
+        """Histórico, etapa e versão do histórico da sessão (lidos uma vez e mantidos no cache)."""
+        dados = self.storage.get_conversa(self.session_id) or {}
+        return self.storage.listar_mensagens(self.session_id), dados.get("etapa_atual"), versao_historico(dados)
+
+    async def _enviar_novidades(self, request_id: str = None):
+        mensagens, etapa, versao = await run_in_threadpool(self._carregar)
+        resetou = self._versao is not None and versao != self._versao
+        if resetou:
+            # compactado durante a conexão: as posições (seq) mudaram
+            await self.enviar({"type": "reset", "versao": versao})
+            self._seq = 0
+        self._versao = versao
+        # o seq de uma mensagem é a sua posição no histórico
+        for seq, m in enumerate(mensagens[self._seq:], start=self._seq + 1):
+            evento = {"type": "message", "seq": seq, "role": m.get("role"), "content": m.get("content")}
+            if request_id and m.get("role") == "user":
+                evento["request_id"] = request_id
+            await self.enviar(evento)
+        self._seq = max(self._seq, len(mensagens))
+        if resetou:
+            await self.enviar({"type": "sincronizado", "seq": self._seq, "versao": versao})
+        if etapa and etapa != self._etapa:
+            self._etapa = etapa
+            await self.enviar({"type": "etapa", "etapa": etapa})
+
+    async def _abrir_sessao(self):
+        if eh_sessao_legada(self.session_id):
+            legado = self.session_id
+            self.session_id = await run_in_threadpool(
+                session_service.executar_turno, legado, lambda: migrar_sessao_legada(legado)
+            )
+            self.ultimo_seq = 0
+            await self.enviar({"type": "session", "session_id": self.session_id})
+        await self._registrar()
+        # mensagens que o cliente já tem não são reenviadas
+        mensagens, _, versao = await run_in_threadpool(self._carregar)
+        if self.ultimo_seq and (self.ultimo_seq > len(mensagens) or versao != self.versao_cliente):
+            # histórico compactado desde a última conexão: o seq do cliente não vale mais, reenvia tudo
+            await self.enviar({"type": "reset", "versao": versao})
+            self.ultimo_seq = 0
+        self._seq = self.ultimo_seq
+        self._versao = versao
+        await self._enviar_novidades()
+        await self.enviar({"type": "sincronizado", "seq": self._seq, "versao": self._versao})
+
+    # --- turnos ---
+
+    def _executar_turno(self, content: str, request_id: str = None):
+        if self._service is None:
+            self._service = OpenAIService(self.storage)
+
+        def turno():
+            return self._service.send_message(self.session_id, {"role": "user", "content": content})
+
+        return session_service.executar_turno(self.session_id, turno, chave=request_id, storage=self.storage)
+
+    async def _enviar_erro(self, request_id: str, detail: str, **extras):
+        evento = {"type": "error", "detail": detail, **extras}
+        if request_id:
+            evento["request_id"] = request_id
+        await self.enviar(evento)
+
+    async def _processar(self):
+        while True:
+            content, request_id = await self._fila.get()
+            try:
+                if not self.session_id:
+                    # a sessão só é criada na primeira mensagem, como no /input_message
+                    self.session_id = await run_in_threadpool(nova_sessao, self.storage)
+                    await self._registrar()
+                    await self.enviar({"type": "session", "session_id": self.session_id})
+                await run_in_threadpool(self._executar_turno, content, request_id)
+            except SessaoOcupadaError:
+                await self._enviar_erro(request_id, MENSAGEM_OCUPADA)
+            except FilaCheiaError as e:
+                await self._enviar_erro(request_id, MENSAGEM_FILA_CHEIA, retry_after=e.retry_after)
+            except Exception as e:
+                print(f"Erro no turno da sessão {self.session_id}: {e}")
+                traceback.print_exc()
+                await self._enviar_erro(request_id, "Ocorreu um erro interno. Pode tentar novamente?")
+            # a resposta chega como mensagem nova do histórico
+            if self.session_id:
+                await self._enviar_novidades(request_id)
+
+    async def _receber(self):
+        while True:
+            evento = await self.websocket.receive_json()
+            self._recebido_em = time.monotonic()
+            tipo = evento.get("type")
+            if tipo == "ping":
+                await self.enviar({"type": "pong"})
+            elif tipo == "message" and str(evento.get("content") or "").strip():
+                await self._fila.put((evento["content"], evento.get("request_id")))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT)
+            if time.monotonic() - self._recebido_em > 3 * WS_HEARTBEAT:
+                print(f"Conexão da sessão {self.session_id} sem heartbeat, encerrando")
+                await self.websocket.close(code=FECHAMENTO_SEM_HEARTBEAT)
+                return
+            await self.enviar({"type": "ping"})
+
+    async def atender(self):
+        await self.websocket.accept()
+        tarefas = []
+        try:
+            if self.session_id:
+                await self._abrir_sessao()
+            else:
+                await self.enviar({"type": "sincronizado", "seq": 0, "versao": ""})
+            tarefas = [asyncio.create_task(t) for t in (self._receber(), self._processar(), self._heartbeat())]
+            await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+            for tarefa in tarefas:
+                if tarefa.done() and not tarefa.cancelled() and tarefa.exception():
+                    erro = tarefa.exception()
+                    if not isinstance(erro, WebSocketDisconnect):
+                        print(f"Erro na conexão da sessão {self.session_id}: {erro}")
+        except (WebSocketDisconnect, SessaoOcupadaError):
+            pass
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+            if self.session_id:
+                self._desregistrar()
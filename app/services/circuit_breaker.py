@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from app.services.metrics_service import metrics
+
+load_dotenv()
+
+# falhas seguidas que abrem o circuito e tempo (segundos) até a próxima sondagem
+CIRCUITO_FALHAS = int(os.getenv("CIRCUITO_FALHAS", "5"))
+CIRCUITO_ABERTO_SEGUNDOS = float(os.getenv("CIRCUITO_ABERTO_SEGUNDOS", "30"))
+
+FECHADO = "fechado"
+MEIO_ABERTO = "meio_aberto"
+ABERTO = "aberto"
+# valor do gauge circuito_estado
+VALOR_ESTADO = {FECHADO: 0, MEIO_ABERTO: 1, ABERTO: 2}
+
+
+class DependenciaIndisponivelError(Exception):
+    """Serviço externo fora do ar (ou circuito aberto); tentar de novo em `retry_after` segundos."""
+
+    def __init__(self, dependencia: str, retry_after: float = None, mensagem: str = None):
+        super().__init__(mensagem or f"{dependencia} indisponível")
+        self.dependencia = dependencia
+        self.retry_after = retry_after
+
+
+class CircuitoAbertoError(DependenciaIndisponivelError):
+    """Chamada recusada sem tentar: o circuito da dependência está aberto."""
+
+
+class CircuitBreaker():
+    """
+    Circuito de uma dependência externa:
+      - fechado: chamadas passam; `limite_falhas` falhas seguidas abrem o circuito
+      - aberto: chamadas falham na hora, sem ocupar o worker esperando timeout
+      - meio aberto: passado `tempo_aberto`, uma única chamada de sondagem passa;
+        sucesso fecha o circuito, falha reabre
+    """
+
+    def __init__(self, nome: str, limite_falhas: int = CIRCUITO_FALHAS, tempo_aberto: float = CIRCUITO_ABERTO_SEGUNDOS):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self._estado = FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._sonda_em = None
+        self._publicar()
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            return self._estado
+
+    def _publicar(self):
+        metrics.definir("circuito_estado", VALOR_ESTADO[self._estado], dependencia=self.nome)
+
+    def _mudar(self, estado: str):
+        if estado != self._estado:
+            print(f"Circuito {self.nome}: {self._estado} -> {estado}")
+            self._estado = estado
+            self._publicar()
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(1.0, self._aberto_em + self.tempo_aberto - time.monotonic())
+
+    def permitir(self) -> bool:
+        """True se a chamada pode ser feita agora (no meio aberto, só a sondagem)."""
+        agora = time.monotonic()
+        with self._lock:
+            if self._estado == FECHADO:
+                return True
+            if self._estado == ABERTO:
+                if agora - self._aberto_em < self.tempo_aberto:
+                    metrics.incrementar("circuito_rejeitadas_total", dependencia=self.nome)
+                    return False
+                self._mudar(MEIO_ABERTO)
+                self._sonda_em = None
+            # meio aberto: uma sondagem por vez (a que não voltar em `tempo_aberto` é substituída)
+            if self._sonda_em is None or agora - self._sonda_em > self.tempo_aberto:
+                self._sonda_em = agora
+                return True
+            metrics.incrementar("circuito_rejeitadas_total", dependencia=self.nome)
+            return False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._sonda_em = None
+            self._mudar(FECHADO)
+
+    def registrar_falha(self):
+        metrics.incrementar("circuito_falhas_total", dependencia=self.nome)
+        with self._lock:
+            self._falhas += 1
+            if self._estado == MEIO_ABERTO or self._falhas >= self.limite_falhas:
+                self._aberto_em = time.monotonic()
+                self._sonda_em = None
+                self._mudar(ABERTO)
+
+    def executar(self, chamada, conta_como_falha=None):
+        """
+        Executa `chamada()` pelo circuito. Exceções são repassadas; contam como
+        falha da dependência as que `conta_como_falha(erro)` aceitar (padrão: todas).
+        """
+        if not self.permitir():
+            raise CircuitoAbertoError(self.nome, self.retry_after())
+        try:
+            resultado = chamada()
+        except Exception as e:
+            if conta_como_falha is None or conta_como_falha(e):
+                self.registrar_falha()
+            else:
+                # a dependência respondeu (ex.: erro 4xx): não indica indisponibilidade
+                self.registrar_sucesso()
+            raise
+        self.registrar_sucesso()
+        return resultado
+
+
+_circuitos = {}
+_lock = threading.Lock()
+
+
+def get_circuito(nome: str) -> CircuitBreaker:
+    """Circuito compartilhado pelo processo para a dependência `nome`."""
+    with _lock:
+        if nome not in _circuitos:
+            _circuitos[nome] = CircuitBreaker(nome)
+        return _circuitos[nome]
@@ -0,0 +1,59 @@
+import datetime
+
+ETAPA_INICIAL = "perguntar_nome"
+
+
+def contador_etapa(etapa: str) -> str:
+    return f"etapa_{etapa}"
+
+
+def contador_agendados(dia: datetime.date) -> str:
+    return f"agendados_{dia.isoformat()}"
+
+
+def cabecalho_conversa(user_id: str) -> dict:
+    """Documento inicial de uma conversa."""
+    return {
+        "user_id": user_id,
+        "created_at": datetime.datetime.utcnow(),
+        "status": "in_progress",
+        "etapa_atual": ETAPA_INICIAL,
+        # a conversa já entra nos contadores do funil ao ser criada
+        "contado": True
+    }
+
+
+# somados quando a conversa é criada
+CONTADORES_NOVA_CONVERSA = {"conversas_total": 1, contador_etapa(ETAPA_INICIAL): 1}
+
+
+def contadores_transicao(anterior: str, nova: str, contado: bool = True) -> dict:
+    """
+    Move um lead de uma etapa para outra nos contadores do funil. Conversas que
+    nunca foram contadas (criadas antes dos contadores) não saem da etapa
+    anterior: passam a contar na etapa nova, e quem grava marca `contado`.
+    """
+    if not contado:
+        return {"conversas_total": 1, contador_etapa(nova): 1}
+    if anterior == nova:
+        return {}
+    return {contador_etapa(anterior): -1, contador_etapa(nova): 1}
+
+
+def contadores_agendamento(dia: datetime.date) -> dict:
+    return {"agendados_total": 1, contador_agendados(dia): 1}
+
+
+def montar_estatisticas(contadores: dict, hoje: datetime.date) -> dict:
+    prefixo = contador_etapa("")
+    return {
+        "conversas_total": contadores.get("conversas_total", 0),
+        "etapas": {
+            chave[len(prefixo):]: valor
+            for chave, valor in contadores.items()
+            if chave.startswith(prefixo)
+        },
+        "agendados_total": contadores.get("agendados_total", 0),
+        "agendados_hoje": contadores.get(contador_agendados(hoje), 0),
+        "consolidado_em": contadores.get("consolidado_em"),
+    }
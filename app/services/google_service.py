@@ -1,13 +1,21 @@
 import datetime
+import json
 import os.path
+import threading
+import time
+from array import array
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
-from google.auth.transport.requests import Request
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from app.services.circuit_breaker import DependenciaIndisponivelError, get_circuito
+
 
 load_dotenv()
 
@@ -16,33 +24,199 @@ SCOPES=["https://www.googleapis.com/auth/calendar"]
 
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 
+# calendário de trabalho dos consultores (JSON opcional, ver README)
+AGENDA_CONFIG = os.getenv("AGENDA_CONFIG")
+AGENDA_CONSULTOR = os.getenv("AGENDA_CONSULTOR", "primary")
+AGENDA_TIMEZONE = os.getenv("AGENDA_TIMEZONE", "America/Sao_Paulo")
+
+DIAS_SEMANA = ["seg", "ter", "qua", "qui", "sex", "sab", "dom"]
+
+# timeout (segundos) de cada requisição à API do Calendar
+CALENDAR_TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", "10"))
+# idade máxima (segundos) do último free/busy usado quando o Calendar está fora do ar
+FREEBUSY_RESERVA_MAX_IDADE = int(os.getenv("FREEBUSY_RESERVA_MAX_IDADE", "3600"))
+
+AVISO_AGENDA_DESATUALIZADA = (
+    "Não consegui consultar a agenda em tempo real agora, então estes horários podem "
+    "estar desatualizados. Confirmo tudo por email assim que a reunião for marcada."
+)
+
+# último free/busy obtido com sucesso por calendário: (obtido_em, time_max, busy)
+_ultimo_freebusy = {}
+_ultimo_freebusy_lock = threading.Lock()
+
+# credenciais carregadas uma vez por processo; o service (e o httplib2.Http, que não é
+# thread-safe) é criado uma vez por thread. Depois de um fork cada processo recria os seus.
+_calendar_lock = threading.Lock()
+_calendar_creds = None
+_calendar_pid = None
+_calendar_local = threading.local()
+
+
+def _falha_do_calendar(erro: Exception) -> bool:
+    """Erros 4xx (exceto 429) são respostas da API, não indisponibilidade."""
+    if isinstance(erro, HttpError):
+        return erro.resp.status >= 500 or erro.resp.status == 429
+    return True
+
+
+class CalendarioConsultor():
+    """
+    Horário comercial, feriados, duração e intervalo entre reuniões de um consultor.
+    Os horários candidatos de cada dia são calculados uma única vez e guardados
+    em um array ordenado de timestamps (segundos UTC).
+    """
+    def __init__(self, calendar_id: str = "primary", timezone: str = AGENDA_TIMEZONE,
+                 expediente: dict = None, feriados: list = None,
+                 duracao_minutos: int = 60, intervalo_minutos: int = 0, passo_minutos: int = None):
+        self.calendar_id = calendar_id
+        self.tz = ZoneInfo(timezone)
+        # expediente: {"seg": [["09:00", "12:00"], ["13:00", "18:00"]], ...}
+        self.expediente = expediente or {dia: [["09:00", "18:00"]] for dia in DIAS_SEMANA[:5]}
+        self.feriados = {datetime.date.fromisoformat(f) for f in (feriados or [])}
+        self.duracao_minutos = duracao_minutos
+        self.intervalo_minutos = intervalo_minutos
+        self.passo_minutos = passo_minutos
+        # compartilhado pelas threads do processo (requisições e busca antecipada)
+        self._candidatos = {}
+        self._lock = threading.Lock()
+
+    def candidatos_do_dia(self, dia: datetime.date, duracao_minutos: int) -> array:
+        """Inícios possíveis (timestamps UTC, ordenados) para reuniões de `duracao_minutos` no dia."""
+        chave = (dia, duracao_minutos)
+        inicios = self._candidatos.get(chave)
+        if inicios is not None:
+            return inicios
+
+        valores = []
+        if dia not in self.feriados:
+            passo = (self.passo_minutos or duracao_minutos + self.intervalo_minutos) * 60
+            for inicio_str, fim_str in self.expediente.get(DIAS_SEMANA[dia.weekday()], []):
+                inicio = datetime.datetime.combine(dia, datetime.time.fromisoformat(inicio_str), tzinfo=self.tz)
+                fim = datetime.datetime.combine(dia, datetime.time.fromisoformat(fim_str), tzinfo=self.tz)
+                t = int(inicio.timestamp())
+                limite = int(fim.timestamp()) - duracao_minutos * 60
+                while t <= limite:
+                    valores.append(t)
+                    t += passo
+
+        inicios = array("q", sorted(valores))
+        with self._lock:
+            # outra thread pode ter calculado o mesmo dia: fica o primeiro
+            return self._candidatos.setdefault(chave, inicios)
+
+    def descartar_anteriores(self, dia: datetime.date):
+        """Remove do cache os dias que já passaram."""
+        with self._lock:
+            for chave in [c for c in self._candidatos if c[0] < dia]:
+                del self._candidatos[chave]
+
+
+def carregar_calendarios() -> dict:
+    """
+    Lê AGENDA_CONFIG (se existir) no formato:
+    {"consultores": {"primary": {"timezone": "America/Sao_Paulo", "expediente": {...},
+                                 "feriados": ["2025-12-25"], "duracao_minutos": 60,
+                                 "intervalo_minutos": 15}}}
+    """
+    calendarios = {}
+    if AGENDA_CONFIG and os.path.exists(AGENDA_CONFIG):
+        with open(AGENDA_CONFIG, encoding="utf-8") as f:
+            config = json.load(f)
+        for calendar_id, dados in config.get("consultores", {}).items():
+            calendarios[calendar_id] = CalendarioConsultor(calendar_id=calendar_id, **dados)
+    if AGENDA_CONSULTOR not in calendarios:
+        calendarios[AGENDA_CONSULTOR] = CalendarioConsultor(calendar_id=AGENDA_CONSULTOR)
+    return calendarios
+
+
+# carregado uma vez por processo para reaproveitar os candidatos já calculados
+CALENDARIOS = carregar_calendarios()
+
+
+def get_calendario(calendar_id: str = None) -> CalendarioConsultor:
+    calendar_id = calendar_id or AGENDA_CONSULTOR
+    if calendar_id not in CALENDARIOS:
+        CALENDARIOS[calendar_id] = CalendarioConsultor(calendar_id=calendar_id)
+    return CALENDARIOS[calendar_id]
+
+
+def _mesclar_ocupados(busy_periods: list, margem: int) -> tuple:
+    """Converte os períodos ocupados em dois arrays (inícios, fins) ordenados e sem sobreposição."""
+    intervalos = []
+    for b in busy_periods:
+        busy_start = datetime.datetime.fromisoformat(b["start"].replace("Z", "+00:00"))
+        busy_end = datetime.datetime.fromisoformat(b["end"].replace("Z", "+00:00"))
+        intervalos.append((int(busy_start.timestamp()) - margem, int(busy_end.timestamp()) + margem))
+    intervalos.sort()
+
+    inicios, fins = array("q"), array("q")
+    for s, e in intervalos:
+        if fins and s <= fins[-1]:
+            fins[-1] = max(fins[-1], e)
+        else:
+            inicios.append(s)
+            fins.append(e)
+    return inicios, fins
+
+
+def carregar_credenciais() -> Credentials:
+    """
+    Lê o token.json sem renovar o access token: a renovação acontece na primeira
+    requisição (AuthorizedHttp), com CALENDAR_TIMEOUT e dentro do circuit breaker.
+    O fluxo OAuth interativo só roda quando ainda não há token com refresh_token.
+    """
+    creds = None
+    if os.path.exists("token.json"):
+        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+    if creds and (creds.valid or creds.refresh_token):
+        return creds
+
+    flow = InstalledAppFlow.from_client_secrets_file(
+        CLIENT_SECRET, SCOPES
+    )
+    creds = flow.run_local_server(port=8080)
+    with open("token.json", "w") as token:
+        token.write(creds.to_json())
+    return creds
+
+
+def _get_creds() -> Credentials:
+    global _calendar_creds, _calendar_pid
+    with _calendar_lock:
+        if _calendar_creds is None or _calendar_pid != os.getpid():
+            _calendar_creds = carregar_credenciais()
+            _calendar_pid = os.getpid()
+        return _calendar_creds
+
+
+def _get_service():
+    """Service do Calendar da thread atual, criado na primeira chamada."""
+    pid, service = getattr(_calendar_local, "service", (None, None))
+    if service is None or pid != os.getpid():
+        # timeout explícito: uma API lenta (ou a renovação do token) não segura o worker
+        http = AuthorizedHttp(_get_creds(), http=httplib2.Http(timeout=CALENDAR_TIMEOUT))
+        service = build("calendar", "v3", http=http, cache_discovery=False)
+        _calendar_local.service = (os.getpid(), service)
+    return service
+
+
 class GoogleCalendar():
-    def __init__(self):
-        self.creds = self.get_cred()
-        self.service = build("calendar", "v3", credentials=self.creds) 
+    def __init__(self, calendar_id: str = None):
+        self.calendario = get_calendario(calendar_id)
+        self.circuito = get_circuito("google_calendar")
+        # preenchidos quando a consulta usa o último free/busy conhecido
+        self.aviso = None
+        self.cobertura_ate = None
+
+    @property
+    def service(self):
+        # a instância pode ser usada por outra thread (busca antecipada): resolve na hora
+        return _get_service()
 
     def get_now(self):
         return datetime.datetime.now(tz=datetime.timezone.utc)
 
-    def get_cred(self):
-        creds = None
-        if os.path.exists("token.json"):
-            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-        # If there are no (valid) credentials available, let the user log in.
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    CLIENT_SECRET, SCOPES
-                )
-                creds = flow.run_local_server(port=8080)
-                
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-
-        return creds
-    
     def get_agenda(self):
         try:
             print("Getting the upcoming 10 events")
@@ -92,13 +266,32 @@ class GoogleCalendar():
         }
 
         try:
-            response = self.service.freebusy().query(body=body).execute()
-            busy_periods = response.get('calendars', {}).get(calendar_id, {}).get('busy', [])
-            return busy_periods
-
-        except HttpError as error:
+            response = self.circuito.executar(lambda: self.service.freebusy().query(body=body).execute(), _falha_do_calendar)
+        except Exception as error:
+            # sem free/busy não há como saber o que está ocupado: nunca assume agenda livre
             print(f"An error occurred while checking free/busy: {error}")
-            return []
+            return self._ultimo_busy_conhecido(calendar_id, error)
+
+        busy_periods = response.get('calendars', {}).get(calendar_id, {}).get('busy', [])
+        with _ultimo_freebusy_lock:
+            _ultimo_freebusy[calendar_id] = (time.monotonic(), time_max, busy_periods)
+        self.aviso = None
+        self.cobertura_ate = None
+        return busy_periods
+
+    def _ultimo_busy_conhecido(self, calendar_id: str, error: Exception) -> list:
+        """Modo degradado: último free/busy obtido, com aviso, ou DependenciaIndisponivelError."""
+        with _ultimo_freebusy_lock:
+            ultimo = _ultimo_freebusy.get(calendar_id)
+        if ultimo is None or time.monotonic() - ultimo[0] > FREEBUSY_RESERVA_MAX_IDADE:
+            retry_after = getattr(error, "retry_after", None)
+            raise DependenciaIndisponivelError("google_calendar", retry_after) from error
+        obtido_em, time_max, busy_periods = ultimo
+        print(f"⚠️ Usando free/busy de {time.monotonic() - obtido_em:.0f}s atrás para {calendar_id}")
+        self.aviso = AVISO_AGENDA_DESATUALIZADA
+        # depois do fim da consulta antiga não se sabe o que está ocupado
+        self.cobertura_ate = time_max
+        return busy_periods
 
     def get_available(self, time_min: datetime.datetime, time_max: datetime.datetime, calendar_id: str = 'primary') -> list:
         """
@@ -143,70 +336,72 @@ class GoogleCalendar():
         print(free_periods)
         return free_periods
 
-    def create_event(self, summary:str, inicio:datetime.datetime, fim:datetime.datetime, calendar_id: str = 'primary', location: str = None, description: str = None):
+    def create_event(self, summary:str, inicio:datetime.datetime, fim:datetime.datetime, calendar_id: str = 'primary', location: str = None, description: str = None, timezone: str = None):
         event = {
             'summary': summary,
             'location': location,
             'description': description,
             'start': {
                 'dateTime': inicio.isoformat(),
-                'timeZone': inicio.tzinfo.tzname(inicio), 
+                'timeZone': timezone or inicio.tzinfo.tzname(inicio), 
             },
             'end': {
                 'dateTime': fim.isoformat(),
-                'timeZone': fim.tzinfo.tzname(fim),
+                'timeZone': timezone or fim.tzinfo.tzname(fim),
             },
             #adicionar outras propriedades como 'attendees', 'recurrence', 'reminders', etc.
         }
         
-        event = self.service.events().insert(calendarId=calendar_id, body=event).execute()
+        event = self.circuito.executar(lambda: self.service.events().insert(calendarId=calendar_id, body=event).execute(), _falha_do_calendar)
         
         print(f"Event created: {event.get('htmlLink')}")
         
         return event
     
-    def get_available_slots(self, days_ahead: int = 7) -> list[dict]:
+    def get_available_slots(self, days_ahead: int = 7, duracao_minutos: int = None) -> list[dict]:
         """
-        Retorna blocos de 1 hora disponíveis (como objetos datetime)
-        dentro do horário comercial nos próximos dias.
+        Retorna blocos disponíveis (como objetos datetime no fuso do consultor)
+        dentro do horário comercial nos próximos dias, respeitando feriados,
+        duração da reunião e intervalo entre reuniões.
         Ideal para uso ao agendar reuniões.
         """
+        calendario = self.calendario
+        duracao_minutos = duracao_minutos or calendario.duracao_minutos
+        duracao = duracao_minutos * 60
+
         now = datetime.datetime.now(datetime.timezone.utc)
-        end = now + datetime.timedelta(days=days_ahead)
-        busy_periods = self.get_busy(now, end)
+        hoje = now.astimezone(calendario.tz).date()
+        ultimo_dia = hoje + datetime.timedelta(days=days_ahead)
+        time_max = datetime.datetime.combine(ultimo_dia + datetime.timedelta(days=1), datetime.time(0), tzinfo=calendario.tz)
 
-        slots = []
-        start_hour = 9
-        end_hour = 18
-
-        # Converter períodos ocupados para datetime (para comparação)
-        busy_intervals = []
-        for b in busy_periods:
-            start = datetime.datetime.fromisoformat(b["start"].replace("Z", "+00:00"))
-            end = datetime.datetime.fromisoformat(b["end"].replace("Z", "+00:00"))
-            busy_intervals.append((start, end))
-
-        current_day = now.date()
-        while current_day <= end.date():
-            for hour in range(start_hour, end_hour):
-                slot_start = datetime.datetime.combine(
-                    current_day,
-                    datetime.time(hour, 0),
-                    tzinfo=datetime.timezone.utc
-                )
-                slot_end = slot_start + datetime.timedelta(hours=1)
+        busy_periods = self.get_busy(now, time_max.astimezone(datetime.timezone.utc), calendario.calendar_id)
+        busy_starts, busy_ends = _mesclar_ocupados(busy_periods, calendario.intervalo_minutos * 60)
 
+        calendario.descartar_anteriores(hoje)
+        agora = int(now.timestamp())
+        # no modo degradado só oferece horários cobertos pelo free/busy guardado
+        cobertura = int(self.cobertura_ate.timestamp()) if self.cobertura_ate else None
+
+        slots = []
+        j = 0
+        dia = hoje
+        while dia <= ultimo_dia:
+            for inicio in calendario.candidatos_do_dia(dia, duracao_minutos):
                 # Ignorar horários no passado
-                if slot_start < now:
+                if inicio < agora:
                     continue
+                fim = inicio + duracao
+                if cobertura is not None and fim > cobertura:
+                    continue
+                # candidatos e ocupados estão ordenados: basta avançar o ponteiro
+                while j < len(busy_ends) and busy_ends[j] <= inicio:
+                    j += 1
+                if j < len(busy_starts) and busy_starts[j] < fim:
+                    continue
+                slots.append({
+                    "start": datetime.datetime.fromtimestamp(inicio, tz=calendario.tz),
+                    "end": datetime.datetime.fromtimestamp(fim, tz=calendario.tz)
+                })
+            dia += datetime.timedelta(days=1)
 
-                # Verifica conflito com períodos ocupados
-                conflict = any(bs < slot_end and be > slot_start for bs, be in busy_intervals)
-                if not conflict:
-                    slots.append({
-                        "start": slot_start,
-                        "end": slot_end
-                    })
-            current_day += datetime.timedelta(days=1)
-
-        return slots
\ No newline at end of file
+        return slots
@@ -0,0 +1,35 @@
+import datetime
+
+# campos de uma conversa que valem para as próximas conversas do mesmo cliente
+CAMPOS_LEAD = ("nome", "dor")
+
+
+def normalizar_email(email: str) -> str:
+    """Chave do índice de leads."""
+    return (email or "").strip().lower()
+
+
+def campos_para_preencher(lead: dict, dados: dict) -> dict:
+    """Campos do lead que a conversa atual ainda não tem."""
+    return {campo: lead[campo] for campo in CAMPOS_LEAD if lead.get(campo) and not dados.get(campo)}
+
+
+def nome_visivel(dados: dict) -> str | None:
+    """
+    Nome que pode aparecer nas respostas: só o informado na própria conversa.
+    Quem digita o email de outra pessoa não pode receber os dados dela do índice.
+    """
+    if "nome" in (dados.get("campos_do_indice") or []):
+        return None
+    return dados.get("nome")
+
+
+def dados_do_lead(dados: dict) -> dict:
+    """O que a conversa acrescenta ao índice: email, campos coletados e quando foi atualizado."""
+    campos = {campo: dados[campo] for campo in CAMPOS_LEAD if dados.get(campo)}
+    campos["email"] = dados.get("email")
+    campos["atualizado_em"] = datetime.datetime.now(datetime.timezone.utc)
+    for campo in ("horario_escolhido", "event_link"):
+        if dados.get(campo):
+            campos[campo] = dados[campo]
+    return campos
@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dotenv import load_dotenv
+
+from app.services.llm_scheduler import LLM_FILA_MAX, ChamadaCancelada, FilaCheiaError, llm_scheduler
+from app.services.metrics_service import metrics
+
+load_dotenv()
+
+LLM_MODELO = os.getenv("LLM_MODELO", "gpt-4o-mini")
+LLM_MODELO_RESERVA = os.getenv("LLM_MODELO_RESERVA", "gpt-4.1-nano")
+# prazo total (segundos) do turno no modelo principal e da tentativa de reserva
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "12"))
+LLM_DEADLINE_RESERVA = float(os.getenv("LLM_DEADLINE_RESERVA", "6"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "true").lower() == "true"
+# atraso mínimo antes da chamada duplicada (usado enquanto não há amostras de latência)
+LLM_HEDGE_ATRASO_MINIMO = float(os.getenv("LLM_HEDGE_ATRASO_MINIMO", "3"))
+LLM_MAX_TOKENS_SAIDA = int(os.getenv("LLM_MAX_TOKENS_SAIDA", "300"))
+# JSON opcional com ajustes por etapa:
+# {"coletar_email": {"modelo": "gpt-4.1-nano", "instrucoes": "...", "max_tokens_saida": 120, "deadline": 6}}
+LLM_POLITICAS = os.getenv("LLM_POLITICAS")
+
+# respostas prontas quando nenhum modelo responde a tempo
+MENSAGENS_RESERVA = {
+    "perguntar_nome": "Antes de continuarmos, como você gostaria de ser chamado?",
+    "perguntar_dor": "Pode me contar rapidamente qual necessidade ou problema você quer resolver?",
+    "confirmar_interesse": "Você gostaria de agendar uma reunião com nosso time para conversarmos melhor?",
+    "escolher_horario": "Qual dos horários que enviei fica melhor para você? Responda com o número.",
+    "coletar_email": "Qual é o seu email para eu enviar o convite da reunião?",
+}
+MENSAGEM_RESERVA_PADRAO = "Desculpe a demora! Pode repetir sua última mensagem?"
+
+# threads das chamadas: cobrem a fila do scheduler mais as chamadas já em andamento;
+# com todas ocupadas a chamada é recusada na hora, em vez de esperar na fila do executor
+LLM_THREADS = int(os.getenv("LLM_THREADS", str(LLM_FILA_MAX + 32)))
+_executor = ThreadPoolExecutor(max_workers=LLM_THREADS, thread_name_prefix="llm")
+_vagas = threading.BoundedSemaphore(LLM_THREADS)
+
+
+class PoliticaModelo():
+    """Modelo, instruções, limite de saída, prazos, hedge e reserva usados em uma etapa do fluxo."""
+
+    def __init__(self, etapa: str = None, modelo: str = LLM_MODELO, modelo_reserva: str = LLM_MODELO_RESERVA,
+                 instrucoes: str = None, max_tokens_saida: int = LLM_MAX_TOKENS_SAIDA,
+                 deadline: float = LLM_DEADLINE, deadline_reserva: float = LLM_DEADLINE_RESERVA,
+                 hedge: bool = LLM_HEDGE, hedge_atraso_minimo: float = LLM_HEDGE_ATRASO_MINIMO,
+                 mensagem_reserva: str = None):
+        self.etapa = etapa
+        self.modelo = modelo
+        # None = usa o PROMPT completo do OpenAIService
+        self.instrucoes = instrucoes
+        self.max_tokens_saida = max_tokens_saida
+        self.modelo_reserva = modelo_reserva
+        self.deadline = deadline
+        self.deadline_reserva = deadline_reserva
+        self.hedge = hedge
+        self.hedge_atraso_minimo = hedge_atraso_minimo
+        self.mensagem_reserva = mensagem_reserva or MENSAGENS_RESERVA.get(etapa, MENSAGEM_RESERVA_PADRAO)
+
+    def atraso_hedge(self) -> float:
+        """Espera antes de duplicar a chamada: p95 da latência recente do modelo."""
+        p95 = metrics.percentil("llm_latencia_segundos", 95, modelo=self.modelo)
+        return max(self.hedge_atraso_minimo, p95 or 0.0)
+
+
+def carregar_politicas() -> dict:
+    ajustes = {}
+    if LLM_POLITICAS and os.path.exists(LLM_POLITICAS):
+        with open(LLM_POLITICAS, encoding="utf-8") as f:
+            ajustes = json.load(f)
+    return {etapa: PoliticaModelo(etapa=etapa, **dados) for etapa, dados in ajustes.items()}
+
+
+POLITICAS = carregar_politicas()
+
+
+def get_politica(etapa: str) -> PoliticaModelo:
+    return POLITICAS.get(etapa) or PoliticaModelo(etapa=etapa)
+
+
+def _disparar(criar, modelo: str, limite: float, tokens: int, prioridade: int, cancelado: threading.Event):
+    """Agenda uma chamada ao modelo; `criar(modelo, timeout)` faz a requisição."""
+    iniciou = threading.Event()
+
+    def chamada():
+        # admitida depois do cancelamento (ex.: a vaga abriu junto com o fim do prazo)
+        if cancelado.is_set():
+            raise ChamadaCancelada()
+        iniciou.set()
+        inicio = time.monotonic()
+        response = criar(modelo, max(1.0, limite - time.monotonic()))
+        metrics.observar("llm_latencia_segundos", time.monotonic() - inicio, modelo=modelo)
+        return response
+
+    if not _vagas.acquire(blocking=False):
+        metrics.incrementar("llm_rejeitadas_total", motivo="executor_cheio")
+        raise FilaCheiaError(llm_scheduler.retry_after(tokens))
+    futuro = _executor.submit(llm_scheduler.executar, chamada, tokens, prioridade, cancelado)
+    futuro.add_done_callback(lambda _: _vagas.release())
+    return futuro, iniciou
+
+
+def _primeiro_resultado(futuros: list, limite: float):
+    """Primeiro resultado bem-sucedido entre `futuros` até `limite`, ou None."""
+    pendentes = set(futuros)
+    while pendentes:
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return None, None
+        prontos, pendentes = wait(pendentes, timeout=restante, return_when=FIRST_COMPLETED)
+        for futuro in prontos:
+            erro = futuro.exception()
+            if erro is None:
+                return futuro, futuro.result()
+            if isinstance(erro, FilaCheiaError) and not pendentes:
+                raise erro
+            if not isinstance(erro, ChamadaCancelada):
+                print(f"Chamada ao modelo falhou: {erro}")
+    return None, None
+
+
+def chamar_com_politica(criar, politica: PoliticaModelo, tokens: int, prioridade: int = 0):
+    """
+    Chama o modelo com prazo, hedge e reserva. Retorna a resposta do modelo
+    ou None quando o turno deve usar `politica.mensagem_reserva`.
+    """
+    etapa = politica.etapa or "-"
+    inicio = time.monotonic()
+    limite = inicio + politica.deadline
+    cancelado = threading.Event()
+    futuros = []
+
+    try:
+        principal, iniciou = _disparar(criar, politica.modelo, limite, tokens, prioridade, cancelado)
+        futuros.append(principal)
+
+        atraso = politica.atraso_hedge()
+        if politica.hedge and inicio + atraso < limite:
+            vencedor, response = _primeiro_resultado(futuros, inicio + atraso)
+            if vencedor is not None:
+                return response
+            # só duplica se a principal já saiu da fila (senão a lentidão é da fila, não do modelo)
+            if not principal.done() and iniciou.is_set():
+                try:
+                    hedge, _ = _disparar(criar, politica.modelo, limite, tokens, prioridade, cancelado)
+                    futuros.append(hedge)
+                    metrics.incrementar("llm_hedge_total", etapa=etapa)
+                except FilaCheiaError:
+                    # sem vaga para duplicar: segue só com a principal
+                    pass
+
+        vencedor, response = _primeiro_resultado(futuros, limite)
+        if vencedor is not None:
+            if len(futuros) > 1 and vencedor is futuros[1]:
+                metrics.incrementar("llm_hedge_vitorias_total", etapa=etapa)
+            return response
+    finally:
+        # a perdedora é descartada: sai da fila se ainda não começou, senão termina pelo próprio timeout
+        cancelado.set()
+        llm_scheduler.acordar()
+        for futuro in futuros:
+            futuro.cancel()
+
+    print(f"⏱️ Modelo {politica.modelo} não respondeu em {politica.deadline}s (etapa={etapa})")
+    if politica.modelo_reserva and politica.deadline_reserva > 0:
+        limite_reserva = time.monotonic() + politica.deadline_reserva
+        cancelado_reserva = threading.Event()
+        reserva, _ = _disparar(criar, politica.modelo_reserva, limite_reserva, tokens, prioridade, cancelado_reserva)
+        try:
+            vencedor, response = _primeiro_resultado([reserva], limite_reserva)
+        finally:
+            cancelado_reserva.set()
+            llm_scheduler.acordar()
+            reserva.cancel()
+        if vencedor is not None:
+            metrics.incrementar("llm_fallback_total", etapa=etapa, tipo="modelo")
+            return response
+
+    metrics.incrementar("llm_fallback_total", etapa=etapa, tipo="mensagem")
+    return None
+
+
+def registrar_uso(etapa: str, response, latencia: float) -> dict:
+    """Envia o uso de tokens e a latência do turno para as métricas e retorna o resumo do turno."""
+    usage = getattr(response, "usage", None) if response is not None else None
+    uso = {
+        "etapa": etapa,
+        "modelo": getattr(response, "model", None) if response is not None else None,
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "latencia": round(latencia, 3),
+    }
+    metrics.observar("llm_turno_segundos", latencia, etapa=etapa)
+    metrics.observar("llm_tokens_entrada", uso["input_tokens"], etapa=etapa)
+    metrics.observar("llm_tokens_saida", uso["output_tokens"], etapa=etapa)
+    return uso
+
+
+def relatorio_etapas() -> dict:
+    """Tokens e latência por etapa desde o início do processo."""
+    relatorio = {}
+    turnos = metrics.resumo("llm_turno_segundos")
+    entrada = metrics.resumo("llm_tokens_entrada")
+    saida = metrics.resumo("llm_tokens_saida")
+    for chave, resumo in turnos.items():
+        etapa = dict(chave).get("etapa")
+        politica = get_politica(etapa)
+        n = resumo["count"]
+        tokens_entrada = entrada.get(chave, {}).get("sum", 0)
+        tokens_saida = saida.get(chave, {}).get("sum", 0)
+        relatorio[etapa] = {
+            "modelo": politica.modelo,
+            "turnos": n,
+            "tokens_entrada": tokens_entrada,
+            "tokens_saida": tokens_saida,
+            "tokens_entrada_medio": round(tokens_entrada / n, 1),
+            "tokens_saida_medio": round(tokens_saida / n, 1),
+            "latencia_media": round(resumo["sum"] / n, 3),
+            "latencia_p95": metrics.percentil("llm_turno_segundos", 95, etapa=etapa),
+        }
+    return relatorio
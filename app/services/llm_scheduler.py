@@ -0,0 +1,203 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import openai
+from dotenv import load_dotenv
+
+from app.services.metrics_service import metrics
+
+load_dotenv()
+
+# limites da conta na OpenAI
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+LLM_TPM = int(os.getenv("LLM_TPM", "200000"))
+# tamanho máximo da fila e espera máxima por uma vaga
+LLM_FILA_MAX = int(os.getenv("LLM_FILA_MAX", "50"))
+LLM_ESPERA_MAX = float(os.getenv("LLM_ESPERA_MAX", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+
+
+class FilaCheiaError(Exception):
+    """Não há vaga para a chamada agora; o cliente deve tentar depois de `retry_after` segundos."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Fila do modelo cheia, tente novamente em {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class ChamadaCancelada(Exception):
+    """A chamada perdeu a corrida ou o prazo acabou antes de ela sair da fila."""
+
+
+class TokenBucket():
+    """Balde que enche `capacidade` unidades por minuto."""
+
+    def __init__(self, capacidade: float):
+        self.capacidade = capacidade
+        self.taxa = capacidade / 60.0
+        self.disponivel = capacidade
+        self._ultimo = time.monotonic()
+
+    def _encher(self):
+        agora = time.monotonic()
+        self.disponivel = min(self.capacidade, self.disponivel + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def tempo_para(self, quantidade: float) -> float:
+        """Segundos até haver `quantidade` disponível (0 se já houver)."""
+        self._encher()
+        quantidade = min(quantidade, self.capacidade)
+        if self.disponivel >= quantidade:
+            return 0.0
+        return (quantidade - self.disponivel) / self.taxa
+
+    def consumir(self, quantidade: float):
+        self._encher()
+        self.disponivel -= min(quantidade, self.capacidade)
+
+    def ajustar(self, diferenca: float):
+        """Corrige o consumo depois que o uso real é conhecido (positivo = consumiu mais)."""
+        self._encher()
+        self.disponivel = min(self.capacidade, self.disponivel - diferenca)
+
+
+def estimar_tokens(instrucoes: str, context: list, max_saida: int = 300) -> int:
+    """Estimativa grosseira (~4 caracteres por token) da entrada mais a saída esperada."""
+    caracteres = len(instrucoes or "") + sum(len(str(m.get("content") or "")) for m in context)
+    return caracteres // 4 + max_saida
+
+
+def _retry_after(erro: Exception):
+    response = getattr(erro, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+class LLMScheduler():
+    """
+    Controle de admissão das chamadas ao modelo, compartilhado pelo processo:
+      - token buckets de requisições (RPM) e tokens estimados (TPM)
+      - fila de prioridade limitada (menor número = atendido antes)
+      - recusa imediata com FilaCheiaError quando a fila está cheia ou a espera estoura
+      - chamadas abortadas (evento `abortar`) saem da fila sem consumir os baldes
+      - retries respeitando Retry-After; um 429 pausa a fila inteira
+    """
+
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM, tamanho_fila: int = LLM_FILA_MAX,
+                 espera_max: float = LLM_ESPERA_MAX, max_retries: int = LLM_MAX_RETRIES):
+        self.requisicoes = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.tamanho_fila = tamanho_fila
+        self.espera_max = espera_max
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._fila = []
+        self._seq = itertools.count()
+        self._pausado_ate = 0.0
+
+    def _tempo_de_espera(self, tokens: int) -> float:
+        pausa = max(0.0, self._pausado_ate - time.monotonic())
+        return max(pausa, self.requisicoes.tempo_para(1), self.tokens.tempo_para(tokens))
+
+    def _sair_da_fila(self, item):
+        self._fila.remove(item)
+        heapq.heapify(self._fila)
+        metrics.definir("llm_fila_tamanho", len(self._fila))
+        self._cond.notify_all()
+
+    def retry_after(self, tokens: int) -> float:
+        with self._cond:
+            return max(1.0, self._tempo_de_espera(tokens))
+
+    def acordar(self):
+        """Acorda quem espera na fila para conferir o seu evento `abortar`."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def admitir(self, tokens: int, prioridade: int = 0, abortar: threading.Event = None):
+        """
+        Bloqueia até a chamada poder ser feita, ou levanta FilaCheiaError.
+        Se `abortar` for marcado durante a espera (seguido de `acordar()`), a
+        chamada sai da fila e levanta ChamadaCancelada.
+        """
+        inicio = time.monotonic()
+        limite = inicio + self.espera_max
+        with self._cond:
+            if abortar is not None and abortar.is_set():
+                raise ChamadaCancelada()
+            if len(self._fila) >= self.tamanho_fila:
+                metrics.incrementar("llm_rejeitadas_total", motivo="fila_cheia")
+                raise FilaCheiaError(max(1.0, self._tempo_de_espera(tokens)))
+
+            item = (prioridade, next(self._seq))
+            heapq.heappush(self._fila, item)
+            metrics.definir("llm_fila_tamanho", len(self._fila))
+
+            while True:
+                if abortar is not None and abortar.is_set():
+                    self._sair_da_fila(item)
+                    metrics.incrementar("llm_rejeitadas_total", motivo="cancelada")
+                    raise ChamadaCancelada()
+                espera = self._tempo_de_espera(tokens) if self._fila[0] == item else None
+                if espera == 0:
+                    self.requisicoes.consumir(1)
+                    self.tokens.consumir(tokens)
+                    heapq.heappop(self._fila)
+                    metrics.definir("llm_fila_tamanho", len(self._fila))
+                    metrics.observar("llm_espera_fila_segundos", time.monotonic() - inicio)
+                    self._cond.notify_all()
+                    return
+
+                restante = limite - time.monotonic()
+                if restante <= 0 or (espera is not None and espera > restante):
+                    self._sair_da_fila(item)
+                    metrics.incrementar("llm_rejeitadas_total", motivo="timeout")
+                    raise FilaCheiaError(max(1.0, espera or self.espera_max))
+                self._cond.wait(min(restante, espera) if espera is not None else restante)
+
+    def _pausar(self, segundos: float):
+        with self._cond:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+
+    def executar(self, chamada, tokens_estimados: int, prioridade: int = 0, abortar: threading.Event = None):
+        """Executa `chamada()` respeitando os limites; ajusta o balde com o uso real."""
+        for tentativa in range(self.max_retries + 1):
+            self.admitir(tokens_estimados, prioridade, abortar)
+            try:
+                response = chamada()
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                if tentativa >= self.max_retries:
+                    raise
+                espera = _retry_after(e) or min(8.0, 0.5 * 2 ** tentativa) * (1 + random.random())
+                if isinstance(e, openai.RateLimitError):
+                    metrics.incrementar("llm_429_total")
+                    # todo o processo espera, em vez de cada conversa insistir sozinha
+                    self._pausar(espera)
+                else:
+                    time.sleep(espera)
+                print(f"Chamada ao modelo falhou ({type(e).__name__}), tentativa {tentativa + 1}; aguardando {espera:.1f}s")
+                continue
+
+            usage = getattr(response, "usage", None)
+            total = getattr(usage, "total_tokens", None)
+            if total:
+                with self._cond:
+                    self.tokens.ajustar(total - tokens_estimados)
+            return response
+
+
+# compartilhado por todas as conversas do processo
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,97 @@
+import threading
+from collections import deque
+
+# amostras guardadas por série para cálculo de percentis
+JANELA_AMOSTRAS = 1000
+
+
+def _chave(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _formatar_labels(chave: tuple, extra: dict = None) -> str:
+    itens = list(chave) + sorted((extra or {}).items())
+    if not itens:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in itens) + "}"
+
+
+class Metrics():
+    """Contadores, gauges e resumos em memória, exportados no formato do Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}
+        self._gauges = {}
+        self._resumos = {}
+
+    def incrementar(self, nome: str, valor: float = 1, **labels):
+        with self._lock:
+            serie = self._contadores.setdefault(nome, {})
+            chave = _chave(labels)
+            serie[chave] = serie.get(chave, 0) + valor
+
+    def definir(self, nome: str, valor: float, **labels):
+        with self._lock:
+            self._gauges.setdefault(nome, {})[_chave(labels)] = valor
+
+    def observar(self, nome: str, valor: float, **labels):
+        with self._lock:
+            serie = self._resumos.setdefault(nome, {})
+            resumo = serie.get(_chave(labels))
+            if resumo is None:
+                resumo = serie[_chave(labels)] = {"count": 0, "sum": 0.0, "amostras": deque(maxlen=JANELA_AMOSTRAS)}
+            resumo["count"] += 1
+            resumo["sum"] += valor
+            resumo["amostras"].append(valor)
+
+    def contador(self, nome: str, **labels) -> float:
+        with self._lock:
+            return self._contadores.get(nome, {}).get(_chave(labels), 0)
+
+    def percentil(self, nome: str, p: float, **labels):
+        """Percentil `p` (0-100) das últimas amostras, ou None se não houver."""
+        with self._lock:
+            resumo = self._resumos.get(nome, {}).get(_chave(labels))
+            amostras = sorted(resumo["amostras"]) if resumo else []
+        if not amostras:
+            return None
+        idx = min(len(amostras) - 1, int(round(p / 100 * (len(amostras) - 1))))
+        return amostras[idx]
+
+    def resumo(self, nome: str) -> dict:
+        """{labels: {count, sum}} de um resumo."""
+        with self._lock:
+            return {
+                chave: {"count": r["count"], "sum": r["sum"]}
+                for chave, r in self._resumos.get(nome, {}).items()
+            }
+
+    def exportar(self) -> str:
+        linhas = []
+        with self._lock:
+            for nome, serie in sorted(self._contadores.items()):
+                linhas.append(f"# TYPE {nome} counter")
+                for chave, valor in serie.items():
+                    linhas.append(f"{nome}{_formatar_labels(chave)} {valor}")
+            for nome, serie in sorted(self._gauges.items()):
+                linhas.append(f"# TYPE {nome} gauge")
+                for chave, valor in serie.items():
+                    linhas.append(f"{nome}{_formatar_labels(chave)} {valor}")
+            resumos = {
+                nome: {chave: (r["count"], r["sum"], sorted(r["amostras"])) for chave, r in serie.items()}
+                for nome, serie in self._resumos.items()
+            }
+        for nome, serie in sorted(resumos.items()):
+            linhas.append(f"# TYPE {nome} summary")
+            for chave, (count, soma, amostras) in serie.items():
+                for q in (0.5, 0.95, 0.99):
+                    idx = min(len(amostras) - 1, int(round(q * (len(amostras) - 1))))
+                    linhas.append(f"{nome}{_formatar_labels(chave, {'quantile': q})} {amostras[idx]}")
+                linhas.append(f"{nome}_count{_formatar_labels(chave)} {count}")
+                linhas.append(f"{nome}_sum{_formatar_labels(chave)} {soma}")
+        return "\n".join(linhas) + "\n"
+
+
+# registro único do processo
+metrics = Metrics()
@@ -2,18 +2,22 @@ import json
 from dotenv import load_dotenv
 import os
 from openai import OpenAI
-from app.services.google_service import GoogleCalendar
+from app.services.google_service import GoogleCalendar, get_calendario
+from app.services.circuit_breaker import DependenciaIndisponivelError
+from app.services import funil_service, lead_service, slot_prefetch_service
 from app.services.pipefy_service import PipefyService
-from app.database.firebase import db
+from app.services.llm_scheduler import estimar_tokens
+from app.services.llm_policy import chamar_com_politica, get_politica, registrar_uso
+from app.database.storage import ConversationStorage, get_storage
 
 import datetime
 import re
+import time
 import traceback
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-VERZEL_ASSISTANT = os.getenv("VERZEL_ASSISTANT")
 
 PROMPT = """
 Você é Roberto, assistente virtual da Verzel, especializado em marcar reuniões .
@@ -22,6 +26,18 @@ Responda de forma curta (1-3 frases) e nunca pergunte múltiplas coisas ao mesmo
 Sobre a verzel: Somos especialistas em desenvolvimento de sistemas, apoiando nossos clientes desde o planejamento até a sustentação, com garantia de qualidade e eficiência. Há mais de 10 anos, nossos resultados em termos de satisfação de clientes, qualidade e escalabilidade das nossas soluções comprovam que estamos no caminho certo, com uma cultura muito forte baseada em mentoria continua nossos times de desenvolvimento, qualidade, design, experiência do usuário, gestão e agilidade garantem o sucesso em todas as esferas da fábrica de software. Se você necessita desenvolver um projeto especifico, ter um time multidisciplinar, sustentação a longo prazo ou manutenções pontuais nos seus sistemas, a Verzel é a melhor escolha para você.
 """
 
+MENSAGEM_AGENDA_INDISPONIVEL = "Não consegui acessar nossa agenda agora. Pode me chamar de novo em alguns minutos para vermos os horários?"
+
+ORDEM_ETAPAS = ["perguntar_nome", "perguntar_dor", "confirmar_interesse", "escolher_horario", "coletar_email", "finalizado"]
+# campo que encerra cada etapa
+CAMPO_DA_ETAPA = {
+    "perguntar_nome": "nome",
+    "perguntar_dor": "dor",
+    "confirmar_interesse": "interesse_confirmado",
+    "escolher_horario": "horario_escolhido",
+    "coletar_email": "email",
+}
+
 # --- Tool schemas (mantidos) ---
 CONFIRMAR_NOME = {
     "type": "function",
@@ -79,7 +95,7 @@ CONFIRMAR_HORARIO = {
 CONFIRMAR_EMAIL = {
     "type": "function",
     "name": "confirmar_email",
-    "description": "Salva o email do cliente.",
+    "description": "Salva o email do cliente. Use também se o cliente informar o email antes de ser perguntado (clientes que já conversaram conosco são reconhecidos pelo email).",
     "parameters": {
         "type": "object",
         "properties": {
@@ -89,44 +105,45 @@ CONFIRMAR_EMAIL = {
     }
 }
 
+def _buscar_slots_atualizados():
+    google = GoogleCalendar()
+    slots = google.get_available_slots(days_ahead=7)
+    if google.aviso:
+        # free/busy de reserva: não guarda; o turno consulta de novo e avisa o cliente
+        raise DependenciaIndisponivelError("google_calendar")
+    return slots
+
+
 class FirebaseOrganizer():
+    def __init__(self, storage: ConversationStorage = None):
+        self.storage = storage or get_storage()
+
     def get_conversation(self, user_id: str):
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
+        if self.storage.get_conversa(user_id) is None:
             return []
-        messages_ref = doc_ref.collection("messages").order_by("dateTime")
-        messages = messages_ref.stream()
-        messages_list = []
-        for message in messages:
-            msg_data = message.to_dict()
-            messages_list.append({"role": msg_data.get("role"), "content": msg_data.get("content")})
-        return messages_list
+        return self.storage.listar_mensagens(user_id)
 
     def update_conversation(self, user_id, context: list):
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            doc_ref.set({"user_id": user_id, "created_at": datetime.datetime.utcnow(), "status": "in_progress"})
+        self.storage.criar_conversa(user_id, funil_service.cabecalho_conversa(user_id), funil_service.CONTADORES_NOVA_CONVERSA)
+        mensagens = []
         for item in context:
             item_copy = dict(item)
             item_copy["dateTime"] = datetime.datetime.utcnow()
-            doc_ref.collection("messages").add(item_copy)
+            mensagens.append(item_copy)
+        self.storage.adicionar_mensagens(user_id, mensagens)
 
     def salvar_campo(self, user_id, campo, valor):
-        doc_ref = db.collection("conversations").document(user_id)
-        doc_ref.set({campo: valor}, merge=True)
+        self.storage.salvar_campos(user_id, {campo: valor})
         print(f"salvou {campo}: {valor}")
 
-    def get_dados_cliente(self, user_id):
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            return {}
-        return doc.to_dict()
+    def get_dados_cliente(self, user_id, recarregar: bool = False):
+        if recarregar:
+            self.storage.recarregar(user_id)
+        return self.storage.get_conversa(user_id) or {}
 
-    def dados_completos(self, user_id):
-        dados = self.get_dados_cliente(user_id)
+    def dados_completos(self, user_id, dados: dict = None):
+        if dados is None:
+            dados = self.get_dados_cliente(user_id)
         campos_obrigatorios = ['nome', 'dor', 'interesse_confirmado', 'horario_escolhido', 'email']
         faltando = [c for c in campos_obrigatorios if not dados.get(c)]
         if faltando:
@@ -134,49 +151,111 @@ class FirebaseOrganizer():
         return []
 
     def get_etapa(self, user_id):
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
+        dados = self.storage.get_conversa(user_id)
+        if dados is None:
             # inicializa documento com etapa
-            doc_ref.set({"user_id": user_id, "created_at": datetime.datetime.utcnow(), "etapa_atual": "perguntar_nome"}, merge=True)
+            self.storage.criar_conversa(user_id, funil_service.cabecalho_conversa(user_id), funil_service.CONTADORES_NOVA_CONVERSA)
             return "perguntar_nome"
-        dados = doc.to_dict()
         return dados.get("etapa_atual", "perguntar_nome")
 
-    def set_etapa(self, user_id, etapa):
-        self.salvar_campo(user_id, "etapa_atual", etapa)
+    def _dados_para_transicao(self, user_id) -> dict:
+        dados = self.storage.get_conversa(user_id)
+        if dados is None:
+            dados = funil_service.cabecalho_conversa(user_id)
+            self.storage.criar_conversa(user_id, dados, funil_service.CONTADORES_NOVA_CONVERSA)
+        return dados
+
+    def _aplicar_transicao(self, user_id, dados: dict, campos: dict):
+        """Grava `campos` (com a nova `etapa_atual`) e move o lead nos contadores do funil na mesma escrita."""
+        anterior = dados.get("etapa_atual", funil_service.ETAPA_INICIAL)
+        etapa = campos["etapa_atual"]
+        contado = bool(dados.get("contado"))
+        if not contado:
+            campos = dict(campos, contado=True)
+        self.storage.aplicar_transicao(user_id, campos, funil_service.contadores_transicao(anterior, etapa, contado))
+        if etapa != anterior:
+            self._ao_entrar_etapa(user_id, etapa)
+
+    def set_etapa(self, user_id, etapa, dados: dict = None):
+        if dados is None:
+            dados = self._dados_para_transicao(user_id)
+        self._aplicar_transicao(user_id, dados, {"etapa_atual": etapa})
+        print(f"salvou etapa_atual: {etapa}")
+
+    def _ao_entrar_etapa(self, user_id, etapa):
+        if etapa == "confirmar_interesse":
+            # a próxima resposta oferece horários: consulta o Calendar enquanto o cliente responde
+            slot_prefetch_service.agendar_prefetch(user_id, _buscar_slots_atualizados, self.storage)
 
     def avancar_etapa(self, user_id):
-        ordem = ["perguntar_nome", "perguntar_dor", "confirmar_interesse", "escolher_horario", "coletar_email", "finalizado"]
-        atual = self.get_etapa(user_id)
+        dados = self._dados_para_transicao(user_id)
+        atual = dados.get("etapa_atual", funil_service.ETAPA_INICIAL)
         try:
-            proxima = ordem[ordem.index(atual) + 1]
+            proxima = ORDEM_ETAPAS[ORDEM_ETAPAS.index(atual) + 1]
         except (ValueError, IndexError):
             proxima = "finalizado"
-        self.set_etapa(user_id, proxima)
+        self.set_etapa(user_id, proxima, dados=dados)
         print(f"➡️ Avançou etapa: {proxima}")
         return proxima
     
+    def etapa_pendente(self, dados: dict) -> str:
+        """Primeira etapa cujo campo ainda não foi coletado."""
+        for etapa in ORDEM_ETAPAS:
+            campo = CAMPO_DA_ETAPA.get(etapa)
+            if campo is None or dados.get(campo) is None:
+                return etapa
+        return "finalizado"
+
+    def reconhecer_lead(self, user_id, email: str) -> dict:
+        """
+        Salva o email e procura o cliente no índice de leads (uma leitura pela chave).
+        Se ele já conversou conosco, preenche os dados que faltam e pula as etapas
+        já respondidas. Retorna os campos preenchidos pelo índice.
+        O email não é verificado: os campos do índice não vão para o prompt nem
+        para as respostas (`campos_do_indice` marca quais são).
+        """
+        chave = lead_service.normalizar_email(email)
+        lead = self.storage.get_lead(chave)
+        dados = self.get_dados_cliente(user_id)
+        campos = {"email": email}
+        preenchidos = {}
+        if lead:
+            preenchidos = lead_service.campos_para_preencher(lead, dados)
+            campos.update(preenchidos, lead_recorrente=True, campos_do_indice=sorted(preenchidos))
+            print(f"Lead recorrente {chave}: preenchendo {sorted(preenchidos)}")
+        dados.update(campos)
+
+        campos["etapa_atual"] = self.etapa_pendente(dados)
+        self._aplicar_transicao(user_id, dados, campos)
+        self.storage.salvar_lead(chave, lead_service.dados_do_lead(dados), user_id)
+        return preenchidos
+
+    def atualizar_lead(self, user_id, dados: dict):
+        if not dados.get("email"):
+            return
+        try:
+            chave = lead_service.normalizar_email(dados["email"])
+            self.storage.salvar_lead(chave, lead_service.dados_do_lead(dados), user_id)
+        except Exception as e:
+            # o índice só agiliza as próximas conversas; não deve derrubar o agendamento
+            print(f"Erro ao atualizar lead: {e}")
+
+    def registrar_agendamento(self, user_id, campos: dict, dia: datetime.date):
+        campos = dict(campos, status="agendado")
+        self.storage.aplicar_transicao(user_id, campos, funil_service.contadores_agendamento(dia))
+        print(f"salvou agendamento: {campos}")
+
+    def get_estatisticas(self, consolidar: bool = False):
+        """Contadores do funil (uma leitura; `consolidar` soma os shards antes)."""
+        if consolidar:
+            self.storage.consolidar_contadores()
+        hoje = datetime.datetime.now(get_calendario().tz).date()
+        return funil_service.montar_estatisticas(self.storage.ler_contadores(), hoje)
+
     def get_messages(self, session_id: str):
         """Busca todas as mensagens de uma sessão para exibir no frontend"""
         try:
-            messages_ref = (
-                db.collection('conversations')
-                .document(session_id)
-                .collection('messages')
-                .order_by('dateTime')
-            )
-            
-            docs = messages_ref.stream()
-            
-            messages = []
-            for doc in docs:
-                data = doc.to_dict()
-                messages.append({
-                    "role": data.get("role"),
-                    "content": data.get("content")
-                })
-            
+            messages = self.storage.listar_mensagens(session_id)
             print(f"{len(messages)} mensagens carregadas para {session_id}")
             return messages
             
@@ -187,16 +266,14 @@ class FirebaseOrganizer():
 
 
 class OpenAIService:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self._assistant = self.get_openai_assistant()
-        self.Firebase = FirebaseOrganizer()
+    def __init__(self, storage: ConversationStorage = None):
+        # os retries ficam a cargo do llm_scheduler
+        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        self.Firebase = FirebaseOrganizer(storage)
         self.Google = GoogleCalendar()
         self.Pipefy = PipefyService()
-        self.db = db
-
-    def get_tools(self):
-        return self._assistant.tools if self._assistant else []
+        # uso do modelo nas chamadas do turno atual (inclui as reentradas)
+        self._uso_turno = []
 
     def _validate_email(self, email: str) -> bool:
         # regex simples, suficiente para validar formato básico
@@ -214,7 +291,7 @@ class OpenAIService:
         # slots expected list of dicts with keys 'start', 'end' as datetimes
         lines = []
         for i, s in enumerate(slots, start=1):
-            local_time = s["start"].astimezone(datetime.timezone(datetime.timedelta(hours=-3)))
+            local_time = s["start"].astimezone(self.Google.calendario.tz)
             lines.append(f"{i}. {local_time.strftime('%A, %d/%m às %H:%M')}")
         return "Ótimo! Tenho estes horários disponíveis:\n\n" + "\n".join(lines) + "\n\nResponda com o número (ex: 1) para escolher."
 
@@ -253,25 +330,35 @@ class OpenAIService:
                     return {"should_continue": False, "message": "Entendi. Se mudar de ideia, me avise!"}
                 # confirmado == True
                 self.Firebase.salvar_campo(user_id, "interesse_confirmado", True)
-                # pega horários e salva slots_oferecidos no documento
-                horarios = self.Google.get_available_slots(days_ahead=7)
-                if not horarios:
+                # usa os horários buscados ao entrar na etapa, se ainda valerem; senão consulta agora
+                dados = self.Firebase.get_dados_cliente(user_id)
+                slots_list = slot_prefetch_service.slots_antecipados(user_id, dados)
+                aviso = None
+                if slots_list is None:
+                    try:
+                        horarios = self.Google.get_available_slots(days_ahead=7)
+                    except DependenciaIndisponivelError:
+                        # Calendar fora do ar e sem free/busy recente: responde na hora
+                        return {"should_continue": False, "message": MENSAGEM_AGENDA_INDISPONIVEL}
+                    aviso = self.Google.aviso
+                    slots_list = slot_prefetch_service.serializar_slots(horarios[:slot_prefetch_service.SLOTS_OFERECIDOS])
+                if not slots_list:
                     return {"should_continue": False, "message": "Desculpe — no momento não há horários disponíveis. Posso tentar novamente mais tarde?"}
-                # transforma para serializável e salva
-                slots_list = []
-                for s in horarios[:5]:
-                    # certifica que start/end são datetimes
-                    start_iso = s["start"].isoformat()
-                    end_iso = s["end"].isoformat()
-                    slots_list.append({"start": start_iso, "end": end_iso})
-                self.Firebase.salvar_campo(user_id, "slots_oferecidos", json.dumps(slots_list))
+                # salva slots_oferecidos no documento e descarta a busca antecipada
+                self.Firebase.storage.salvar_campos(user_id, {
+                    "slots_oferecidos": json.dumps(slots_list),
+                    "slots_prefetch": None,
+                    "slots_prefetch_em": None
+                })
                 self.Firebase.avancar_etapa(user_id)
-                # Formata mensagem com os horários no timezone -3
+                # Formata mensagem com os horários no fuso do consultor
                 # reconstrói os datetimes para mensagem legível
                 parsed_slots = []
                 for s in slots_list:
                     parsed_slots.append({"start": datetime.datetime.fromisoformat(s["start"])})
                 msg = self._format_slots_message(parsed_slots)
+                if aviso:
+                    msg += f"\n\n⚠️ {aviso}"
                 return {"should_continue": False, "message": msg}
 
             elif function_name == "confirmar_horario":
@@ -316,8 +403,7 @@ class OpenAIService:
                 email = args.get("email", "").strip()
                 if not self._validate_email(email):
                     return {"should_continue": False, "message": "Esse email não parece válido. Pode verificar e enviar novamente?"}
-                self.Firebase.salvar_campo(user_id, "email", email)
-                self.Firebase.avancar_etapa(user_id)
+                self.Firebase.reconhecer_lead(user_id, email)
                 return {"should_continue": True, "message": None}
 
         except Exception as e:
@@ -331,16 +417,28 @@ class OpenAIService:
         """
         Fluxo principal: processa a mensagem do usuário e gera a resposta.
         """
+        # o serviço é reaproveitado entre turnos (WebSocket): o uso começa vazio a cada mensagem
+        self._uso_turno = []
+        try:
+            return self._responder(user_id, message_received)
+        finally:
+            self._uso_turno = []
+
+    def _responder(self, user_id: str, message_received: dict) -> str:
         # garante que o documento existe e salva imediatamente a mensagem do usuário
-        self.Firebase.update_conversation(user_id, [message_received])
+        # (as reentradas após uma função chegam vazias e não vão para o histórico)
+        if message_received.get("content"):
+            self.Firebase.update_conversation(user_id, [message_received])
 
         #  se todos os dados já foram coletados
-        faltando = self.Firebase.dados_completos(user_id)
+        dados = self.Firebase.get_dados_cliente(user_id)
+        faltando = self.Firebase.dados_completos(user_id, dados)
         if not faltando:
-            return self.marcar_reuniao(user_id)
+            return self._agendar(user_id)
 
         etapa = self.Firebase.get_etapa(user_id)
-        prompt = f"{PROMPT}\nEtapa atual: {etapa}\nCampos faltando: {', '.join(faltando)}"
+        politica = get_politica(etapa)
+        prompt = f"{politica.instrucoes or PROMPT}\nEtapa atual: {etapa}\nCampos faltando: {', '.join(faltando)}"
 
         #prepara contexto
         context = self.Firebase.get_conversation(user_id)
@@ -355,25 +453,41 @@ class OpenAIService:
             tools_ = [CONFIRMAR_INTERESSE]
         elif etapa == "escolher_horario":
             tools_ = [CONFIRMAR_HORARIO]
-        elif etapa == "coletar_email":
-            tools_ = [CONFIRMAR_EMAIL]
+        # o email é aceito em qualquer etapa: um cliente conhecido pula as perguntas já respondidas
+        if etapa in CAMPO_DA_ETAPA:
+            tools_ = tools_ + [CONFIRMAR_EMAIL]
 
         print(f"Tools liberadas: {[t['name'] for t in tools_]}, etapa={etapa}")
 
-        # chama a API 
-        response = self.client.responses.create(
-            model="gpt-4o-mini",
-            instructions=prompt,
-            input=context,
-            tools=tools_
+        # chama a API passando pelo controle de admissão e pela política da etapa
+        # (prazo, hedge e reserva); conversas mais perto do fim têm prioridade na fila
+        prioridade = -ORDEM_ETAPAS.index(etapa) if etapa in ORDEM_ETAPAS else 0
+        inicio = time.monotonic()
+        response = chamar_com_politica(
+            lambda modelo, timeout: self.client.responses.create(
+                model=modelo,
+                instructions=prompt,
+                input=context,
+                tools=tools_,
+                max_output_tokens=politica.max_tokens_saida,
+                timeout=timeout
+            ),
+            politica,
+            tokens=estimar_tokens(prompt, context, politica.max_tokens_saida),
+            prioridade=prioridade
         )
+        self._registrar_uso(user_id, registrar_uso(etapa, response, time.monotonic() - inicio))
 
         assistant_message = ""
         function_response_direct = None
         should_repeat = False
 
+        # sem resposta do modelo a tempo: usa a pergunta pronta da etapa
+        if response is None:
+            assistant_message = politica.mensagem_reserva
+
         # percorre saída e trata mensagens ou chamadas de função
-        for item in response.output:
+        for item in (response.output if response is not None else []):
             if item.type == "message":
                 # mensagem textual do assistant
                 assistant_message = item.content[0].text
@@ -394,54 +508,88 @@ class OpenAIService:
         # se a função alterou estado e deve continuar, chama send_message recursivamente
         if should_repeat:
             # chama recursivamente
-            return self.send_message(user_id, {"role": "user", "content": ""})
+            return self._responder(user_id, {"role": "user", "content": ""})
 
-        # salva resposta do assistant no histórico
-        context_to_save = [{"role": "assistant", "content": assistant_message}]
+        # salva resposta do assistant no histórico, com o uso do modelo no turno
+        context_to_save = [{"role": "assistant", "content": assistant_message, "usage": self._uso_turno}]
+        self._uso_turno = []
         self.Firebase.update_conversation(user_id, context_to_save)
 
         # se todos os dados estão ok, dispara agendamento
         faltando_depois = self.Firebase.dados_completos(user_id)
         if not faltando_depois:
-            return self.marcar_reuniao(user_id)
+            return self._agendar(user_id)
 
         return assistant_message
 
-    def get_openai_assistant(self):
-        try:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            assistant = client.beta.assistants.retrieve(assistant_id=VERZEL_ASSISTANT)
-            return assistant
-        except Exception:
-            return None
+    def _agendar(self, user_id: str) -> str:
+        """Marca a reunião e salva a resposta no histórico (o WebSocket só envia o que está no histórico)."""
+        resposta = self.marcar_reuniao(user_id)
+        # o uso das chamadas que levaram ao agendamento fica na resposta do agendamento
+        mensagem = {"role": "assistant", "content": resposta}
+        if self._uso_turno:
+            mensagem["usage"] = self._uso_turno
+        self._uso_turno = []
+        self.Firebase.update_conversation(user_id, [mensagem])
+        return resposta
+
+    def _registrar_uso(self, user_id: str, uso: dict):
+        self._uso_turno.append(uso)
+        if uso["modelo"] is None:
+            # resposta pronta da reserva: nenhuma chamada ao modelo foi concluída
+            return
+        self.Firebase.storage.incrementar_campos(user_id, {
+            "tokens_entrada": uso["input_tokens"],
+            "tokens_saida": uso["output_tokens"],
+            "chamadas_modelo": 1
+        })
 
     def marcar_reuniao(self, user_id):
-        dados = self.Firebase.get_dados_cliente(user_id)
+        # lido do storage (não do cache da conexão): a trava contra evento/card duplicado depende do status atual
+        dados = self.Firebase.get_dados_cliente(user_id, recarregar=True)
         nome = dados.get("nome", "Cliente")
+        # nas respostas, só o nome informado nesta conversa (o do índice de leads não é exibido)
+        nome_exibido = lead_service.nome_visivel(dados)
+        saudacao = f", {nome_exibido}" if nome_exibido else ""
         email = dados.get("email", "")
         horario_iso = dados.get("horario_escolhido")
         dor = dados.get("dor", "Sem descrição")
+        if dados.get("status") == "agendado" and dados.get("event_link"):
+            # reunião já criada (ex.: mensagem repetida); não duplica evento nem card
+            return f"Sua reunião já está marcada{saudacao}!\n\nLink: {dados.get('event_link')}"
         try:
+            calendario = self.Google.calendario
             inicio = datetime.datetime.fromisoformat(horario_iso.replace("Z", "+00:00"))
-            fim = inicio + datetime.timedelta(hours=1)
+            fim = inicio + datetime.timedelta(minutes=calendario.duracao_minutos)
             event = self.Google.create_event(
                 summary=f"Reunião Verzel - {nome}",
                 inicio=inicio,
                 fim=fim,
-                description=f"Cliente: {nome}\nEmail: {email}\n\nNecessidade:\n{dor}"
+                calendar_id=calendario.calendar_id,
+                description=f"Cliente: {nome}\nEmail: {email}\n\nNecessidade:\n{dor}",
+                timezone=calendario.tz.key
             )
             event_link = event.get('htmlLink', '')
             resultado_pipefy = self.Pipefy.criar_card(dados, event_link)
-            self.Firebase.salvar_campo(user_id, "status", "agendado")
-            self.Firebase.salvar_campo(user_id, "event_link", event_link)
-            self.Firebase.salvar_campo(user_id, "pipefy_card_id", resultado_pipefy.get('card_id', ''))
-            self.Firebase.salvar_campo(user_id, "pipefy_card_url", resultado_pipefy.get('card_url', ''))
-            local_time = inicio.astimezone(datetime.timezone(datetime.timedelta(hours=-3)))
+            campos = {
+                "event_link": event_link,
+                "pipefy_card_id": resultado_pipefy.get('card_id', ''),
+                "pipefy_card_url": resultado_pipefy.get('card_url', '')
+            }
+            if resultado_pipefy.get("indisponivel"):
+                # Pipefy fora do ar: o card é criado depois pelo job app.jobs.pipefy_pendentes
+                campos["pipefy_pendente"] = True
+            self.Firebase.registrar_agendamento(user_id, campos, datetime.datetime.now(calendario.tz).date())
+            self.Firebase.atualizar_lead(user_id, dict(dados, event_link=event_link))
+            local_time = inicio.astimezone(calendario.tz)
             return (
-                f"🎉 Tudo certo, {nome}!\n"
+                f"🎉 Tudo certo{saudacao}!\n"
                 f"Sua reunião está marcada para {local_time.strftime('%d/%m às %H:%M')}h.\n"
                 f"Enviei um convite para {email}.\n\nLink: {event_link}"
             )
+        except DependenciaIndisponivelError as e:
+            print("Calendar indisponível ao criar evento:", e)
+            return "Não consegui acessar nossa agenda para confirmar a reunião agora. Seus dados estão salvos; me chame de novo em alguns minutos que eu finalizo o agendamento."
         except Exception as e:
             print("Erro ao criar evento:", e)
             traceback.print_exc()
@@ -3,8 +3,13 @@ import requests
 import datetime
 from dotenv import load_dotenv
 
+from app.services.circuit_breaker import get_circuito
+
 load_dotenv()
 
+# timeout (segundos) das chamadas à API do Pipefy
+PIPEFY_TIMEOUT = float(os.getenv("PIPEFY_TIMEOUT", "10"))
+
 class PipefyService:
     def __init__(self):
         self.token = os.getenv("PIPEFY_API_KEY")
@@ -15,6 +20,7 @@ class PipefyService:
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
         }
+        self.circuito = get_circuito("pipefy")
     
     def listar_campos(self):
         """Lista todos os campos do pipe para descobrir os IDs"""
@@ -38,7 +44,7 @@ class PipefyService:
             self.url,
             json={"query": query},
             headers=self.headers,
-            timeout=10
+            timeout=PIPEFY_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -73,6 +79,14 @@ class PipefyService:
                     "success": False,
                     "error": "Credenciais do Pipefy não configuradas"
                 }
+
+            # circuito aberto: não espera o timeout; o card fica pendente para depois
+            if not self.circuito.permitir():
+                return {
+                    "success": False,
+                    "error": "Pipefy indisponível",
+                    "indisponivel": True
+                }
             
             # Pega os dados
             nome = dados_cliente.get("nome", "Cliente")
@@ -148,13 +162,31 @@ class PipefyService:
             )
             """
             
-            response = requests.post(
-                self.url,
-                json={"query": mutation},
-                headers=self.headers,
-                timeout=10
-            )
-            
+            try:
+                response = requests.post(
+                    self.url,
+                    json={"query": mutation},
+                    headers=self.headers,
+                    timeout=PIPEFY_TIMEOUT
+                )
+            except requests.RequestException as e:
+                self.circuito.registrar_falha()
+                print(f"Pipefy indisponível: {e}")
+                return {
+                    "success": False,
+                    "error": str(e),
+                    "indisponivel": True
+                }
+
+            if response.status_code >= 500 or response.status_code == 429:
+                self.circuito.registrar_falha()
+                return {
+                    "success": False,
+                    "error": f"Erro HTTP: {response.status_code}",
+                    "indisponivel": True
+                }
+            self.circuito.registrar_sucesso()
+
             if response.status_code == 200:
                 result = response.json()
 
@@ -233,7 +265,7 @@ class PipefyService:
                 self.url,
                 json={"query": mutation},
                 headers=self.headers,
-                timeout=10
+                timeout=PIPEFY_TIMEOUT
             )
             
             if response.status_code == 200:
@@ -264,7 +296,7 @@ class PipefyService:
                 self.url,
                 json={"query": mutation},
                 headers=self.headers,
-                timeout=10
+                timeout=PIPEFY_TIMEOUT
             )
             
             if response.status_code == 200 and "errors" not in response.json():
@@ -0,0 +1,219 @@
+import datetime
+import os
+import re
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from dotenv import load_dotenv
+
+from app.database.storage import ConversationStorage, TRANSCRICAO, compactar_mensagens, get_storage
+from app.services.funil_service import CONTADORES_NOVA_CONVERSA, ETAPA_INICIAL, cabecalho_conversa, contadores_transicao
+
+load_dotenv()
+
+# validade do lease de um turno; enquanto o turno roda o lease é renovado a cada 1/3 desse tempo,
+# então o TTL só limita quanto uma sessão fica presa depois que o worker que a segurava morre
+SESSION_LEASE_TTL = int(os.getenv("SESSION_LEASE_TTL", "60"))
+# quanto tempo uma requisição espera a sessão ficar livre antes de desistir
+SESSION_LOCK_TIMEOUT = float(os.getenv("SESSION_LOCK_TIMEOUT", "30"))
+
+# ids no formato {balde}-{instante}-{aleatório}: dentro de cada balde os ids seguem a ordem
+# de criação, então um período é varrido com uma consulta por faixa em cada balde
+# (ver faixas_de_session_id); os baldes continuam espalhando as escritas
+SESSION_ID_COM_TEMPO = os.getenv("SESSION_ID_COM_TEMPO", "false").lower() == "true"
+
+# baldes do id com tempo (2 dígitos hex)
+SESSION_ID_BALDES = 256
+
+# ids antigos: visitor_{0..10000} (backend) e visitor_{timestamp}_{aleatório} (frontend)
+SESSAO_LEGADA = re.compile(r"^visitor_")
+
+
+class SessaoOcupadaError(Exception):
+    """A sessão continuou ocupada por outro turno até o fim do timeout."""
+
+
+class SessionService():
+    """
+    Serializa os turnos de uma mesma sessão:
+      - lock local por session_id (threads do mesmo worker)
+      - lease no storage (workers diferentes)
+      - chave de idempotência: envios repetidos aguardam o mesmo turno e recebem a mesma resposta
+    """
+
+    def __init__(self, storage: ConversationStorage = None):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._em_andamento = {}
+
+    def _get_storage(self) -> ConversationStorage:
+        return self.storage or get_storage()
+
+    def _lock_da_sessao(self, session_id: str):
+        with self._lock:
+            entrada = self._locks.get(session_id)
+            if entrada is None:
+                entrada = self._locks[session_id] = [threading.Lock(), 0]
+            entrada[1] += 1
+            return entrada
+
+    def _soltar_lock_da_sessao(self, session_id: str, entrada: list):
+        with self._lock:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                self._locks.pop(session_id, None)
+
+    def _adquirir_lease(self, session_id: str, dono: str, limite: float):
+        espera = 0.05
+        while not self._get_storage().adquirir_lease(session_id, dono, SESSION_LEASE_TTL):
+            if time.monotonic() >= limite:
+                raise SessaoOcupadaError(session_id)
+            time.sleep(espera)
+            espera = min(espera * 2, 1.0)
+
+    def _renovar_lease(self, session_id: str, dono: str, parar: threading.Event):
+        """Mantém o lease enquanto o turno roda (chamadas ao modelo, Calendar e Pipefy podem passar do TTL)."""
+        while not parar.wait(SESSION_LEASE_TTL / 3):
+            try:
+                if not self._get_storage().adquirir_lease(session_id, dono, SESSION_LEASE_TTL):
+                    print(f"Lease da sessão {session_id} perdido durante o turno")
+                    return
+            except Exception as e:
+                # falha momentânea do storage: tenta de novo no próximo intervalo
+                print(f"Erro ao renovar o lease da sessão {session_id}: {e}")
+
+    def _executar_serializado(self, session_id: str, chave: str, turno, storage: ConversationStorage = None):
+        limite = time.monotonic() + SESSION_LOCK_TIMEOUT
+        entrada = self._lock_da_sessao(session_id)
+        try:
+            if not entrada[0].acquire(timeout=SESSION_LOCK_TIMEOUT):
+                raise SessaoOcupadaError(session_id)
+            try:
+                # dono único por turno: workers criados por fork (ex.: gunicorn --preload) herdam
+                # o estado do master, e ids de thread se repetem entre processos
+                dono = f"{os.getpid()}-{uuid.uuid4().hex}"
+                self._adquirir_lease(session_id, dono, limite)
+                parar = threading.Event()
+                threading.Thread(target=self._renovar_lease, args=(session_id, dono, parar), daemon=True).start()
+                try:
+                    storage = storage or self._get_storage()
+                    # com o lease, só este turno escreve na sessão: cópias em cache são relidas uma vez aqui
+                    storage.recarregar(session_id)
+                    if chave:
+                        resposta = storage.get_resultado_turno(session_id, chave)
+                        if resposta is not None:
+                            print(f"Turno {chave} de {session_id} já processado, reaproveitando resposta")
+                            return resposta
+                    resposta = turno()
+                    if chave:
+                        storage.salvar_resultado_turno(session_id, chave, resposta)
+                    return resposta
+                finally:
+                    parar.set()
+                    self._get_storage().liberar_lease(session_id, dono)
+            finally:
+                entrada[0].release()
+        finally:
+            self._soltar_lock_da_sessao(session_id, entrada)
+
+    def executar_turno(self, session_id: str, turno, chave: str = None, storage: ConversationStorage = None):
+        """
+        Executa `turno()` com exclusividade sobre a sessão.
+        Requisições com a mesma `chave` enquanto o turno está em andamento
+        recebem o mesmo resultado em vez de processar de novo.
+        `storage` permite consultar a chave em um cache da sessão.
+        """
+        if not chave:
+            return self._executar_serializado(session_id, None, turno, storage)
+
+        id_turno = (session_id, chave)
+        with self._lock:
+            futuro = self._em_andamento.get(id_turno)
+            dono_do_turno = futuro is None
+            if dono_do_turno:
+                futuro = self._em_andamento[id_turno] = Future()
+
+        if not dono_do_turno:
+            print(f"Turno {chave} de {session_id} já em andamento, aguardando resultado")
+            return futuro.result()
+
+        try:
+            resposta = self._executar_serializado(session_id, chave, turno, storage)
+            futuro.set_result(resposta)
+            return resposta
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._em_andamento.pop(id_turno, None)
+
+
+def gerar_session_id() -> str:
+    """Aleatoriedade no início do id: as chaves se espalham pelo Firestore em vez de se concentrar."""
+    if SESSION_ID_COM_TEMPO:
+        balde = secrets.randbelow(SESSION_ID_BALDES)
+        return f"{balde:02x}-{int(time.time() * 1000):011x}-{secrets.token_hex(6)}"
+    return secrets.token_hex(8)
+
+
+def faixas_de_session_id(inicio: datetime.datetime, fim: datetime.datetime) -> list:
+    """
+    Faixas [menor, maior) de ids (com SESSION_ID_COM_TEMPO) criados entre `inicio` e
+    `fim`, uma por balde, para consultas por intervalo de document id.
+    """
+    de, ate = int(inicio.timestamp() * 1000), int(fim.timestamp() * 1000)
+    return [(f"{balde:02x}-{de:011x}", f"{balde:02x}-{ate:011x}") for balde in range(SESSION_ID_BALDES)]
+
+
+def eh_sessao_legada(session_id: str) -> bool:
+    return bool(SESSAO_LEGADA.match(session_id or ""))
+
+
+def nova_sessao(storage: ConversationStorage = None) -> str:
+    """
+    Cria a conversa com um id novo. A criação só acontece se o documento não
+    existir, então a unicidade é garantida sem uma leitura prévia.
+    """
+    storage = storage or get_storage()
+    for _ in range(5):
+        session_id = gerar_session_id()
+        if storage.criar_conversa(session_id, cabecalho_conversa(session_id), CONTADORES_NOVA_CONVERSA):
+            return session_id
+    raise RuntimeError("Não foi possível gerar um session_id único")
+
+
+def migrar_sessao_legada(session_id: str, storage: ConversationStorage = None) -> str:
+    """
+    Copia uma sessão visitor_* para um id novo e marca a antiga com `migrado_para`.
+    Como vários visitantes podem ter recebido o mesmo id antigo, só o primeiro
+    herda o histórico; os seguintes começam uma sessão nova.
+    """
+    storage = storage or get_storage()
+    dados = storage.get_conversa(session_id)
+    if dados is None or dados.get("migrado_para"):
+        return nova_sessao(storage)
+
+    mensagens = storage.listar_mensagens(session_id)
+    novo_id = nova_sessao(storage)
+    # a sessão migrada está ativa agora (o created_at antigo não serve para arquivar)
+    dados.update({"user_id": novo_id, "migrado_de": session_id, "atualizado_em": datetime.datetime.utcnow()})
+    criado_em = dados.get("created_at") or datetime.datetime.utcnow()
+    if isinstance(criado_em, str):
+        criado_em = datetime.datetime.fromisoformat(criado_em)
+    transcricao = {"role": TRANSCRICAO, "content": compactar_mensagens(mensagens), "dateTime": criado_em}
+    storage.substituir_mensagens(novo_id, [transcricao] if mensagens else [], dados)
+    # nova_sessao contou a conversa na etapa inicial; ela segue na etapa da sessão antiga
+    etapa = dados.get("etapa_atual", ETAPA_INICIAL)
+    storage.aplicar_transicao(novo_id, {"contado": True}, contadores_transicao(ETAPA_INICIAL, etapa))
+    storage.salvar_campos(session_id, {"migrado_para": novo_id})
+    print(f"Sessão {session_id} migrada para {novo_id}")
+    return novo_id
+
+
+# compartilhado pelas requisições do processo
+session_service = SessionService()
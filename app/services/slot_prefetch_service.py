@@ -0,0 +1,109 @@
+import datetime
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturoTimeoutError
+
+from dotenv import load_dotenv
+
+from app.database.storage import ConversationStorage
+from app.services.metrics_service import metrics
+
+load_dotenv()
+
+SLOTS_PREFETCH = os.getenv("SLOTS_PREFETCH", "true").lower() == "true"
+# idade máxima (segundos) dos horários buscados antecipadamente
+SLOTS_PREFETCH_TTL = int(os.getenv("SLOTS_PREFETCH_TTL", "300"))
+# antecedência mínima (minutos) para um horário guardado ainda ser oferecido
+SLOTS_ANTECEDENCIA_MINUTOS = int(os.getenv("SLOTS_ANTECEDENCIA_MINUTOS", "0"))
+# quanto o turno espera por uma busca antecipada que ainda está em andamento
+SLOTS_PREFETCH_ESPERA = float(os.getenv("SLOTS_PREFETCH_ESPERA", "5"))
+
+# horários oferecidos ao cliente; a busca antecipada guarda folga para descartar os que vencerem
+SLOTS_OFERECIDOS = 5
+SLOTS_GUARDADOS = 3 * SLOTS_OFERECIDOS
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SLOTS_PREFETCH_THREADS", "4")), thread_name_prefix="slots")
+_em_andamento = {}
+_lock = threading.Lock()
+
+
+def serializar_slots(slots: list) -> list:
+    return [{"start": s["start"].isoformat(), "end": s["end"].isoformat()} for s in slots]
+
+
+def _buscar(user_id: str, buscar, storage: ConversationStorage) -> list:
+    try:
+        slots = serializar_slots(buscar()[:SLOTS_GUARDADOS])
+        storage.salvar_campos(user_id, {
+            "slots_prefetch": json.dumps(slots),
+            "slots_prefetch_em": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+        metrics.incrementar("slots_prefetch_total", resultado="buscado")
+        return slots
+    except Exception as e:
+        metrics.incrementar("slots_prefetch_total", resultado="erro")
+        print(f"Erro ao buscar horários antecipadamente para {user_id}: {e}")
+        traceback.print_exc()
+        return None
+    finally:
+        with _lock:
+            _em_andamento.pop(user_id, None)
+
+
+def agendar_prefetch(user_id: str, buscar, storage: ConversationStorage):
+    """
+    Busca em segundo plano os horários livres (`buscar()` retorna a lista de
+    {start, end} do GoogleCalendar) e guarda na sessão, para o turno que
+    confirmar o interesse não esperar pelo Calendar.
+    """
+    if not SLOTS_PREFETCH:
+        return
+    with _lock:
+        if user_id in _em_andamento:
+            return
+        _em_andamento[user_id] = _executor.submit(_buscar, user_id, buscar, storage)
+
+
+def slots_validos(slots: list, agora: datetime.datetime) -> list:
+    """Descarta os horários que já começaram ou começam antes da antecedência mínima."""
+    limite = agora + datetime.timedelta(minutes=SLOTS_ANTECEDENCIA_MINUTOS)
+    return [s for s in slots if datetime.datetime.fromisoformat(s["start"]) >= limite]
+
+
+def slots_antecipados(user_id: str, dados: dict) -> list | None:
+    """
+    Horários buscados antecipadamente que ainda podem ser oferecidos, ou None
+    (sem busca, busca antiga demais ou horários insuficientes) para buscar na hora.
+    """
+    with _lock:
+        futuro = _em_andamento.get(user_id)
+
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    slots, buscado_em = None, None
+    if futuro is not None:
+        # a busca já começou: esperar por ela sai mais barato que repetir a consulta
+        try:
+            slots, buscado_em = futuro.result(timeout=SLOTS_PREFETCH_ESPERA), agora
+        except FuturoTimeoutError:
+            metrics.incrementar("slots_prefetch_total", resultado="atrasado")
+            return None
+    elif dados.get("slots_prefetch") and dados.get("slots_prefetch_em"):
+        slots = json.loads(dados["slots_prefetch"])
+        buscado_em = datetime.datetime.fromisoformat(dados["slots_prefetch_em"])
+
+    if slots is None:
+        metrics.incrementar("slots_prefetch_total", resultado="ausente")
+        return None
+    if (agora - buscado_em).total_seconds() > SLOTS_PREFETCH_TTL:
+        metrics.incrementar("slots_prefetch_total", resultado="expirado")
+        return None
+
+    validos = slots_validos(slots, agora)
+    if not validos or len(validos) < min(SLOTS_OFERECIDOS, len(slots)):
+        metrics.incrementar("slots_prefetch_total", resultado="expirado")
+        return None
+    metrics.incrementar("slots_prefetch_total", resultado="usado")
+    return validos[:SLOTS_OFERECIDOS]
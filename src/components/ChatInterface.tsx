@@ -9,16 +9,57 @@ interface Message {
   content: string;
 }
 
+// eventos enviados pelo backend no WebSocket /ws
+interface ServerEvent {
+  type: "session" | "message" | "etapa" | "sincronizado" | "reset" | "error" | "ping" | "pong";
+  session_id?: string;
+  seq?: number;
+  role?: "user" | "assistant";
+  content?: string;
+  request_id?: string;
+  etapa?: string;
+  detail?: string;
+  versao?: string;
+}
+
+const API_BASE_URL = "https://verzel-backend-production.up.railway.app";
+const WS_URL = API_BASE_URL.replace(/^http/, "ws") + "/ws";
+
+const GREETING: Message = {
+  role: "assistant",
+  content: "Olá! Sou o Roberto, da Verzel. Como posso te ajudar hoje?",
+};
+
+// fechamento enviado pelo backend quando a sessão foi aberta em outra aba
+const WS_SUBSTITUIDA = 4000;
+
+// tentativas de envio por HTTP (falha de rede, sessão ocupada ou fila cheia)
+const HTTP_TENTATIVAS = 3;
+const RETRY_STATUS = [409, 429, 503];
+
+const sleep = (ms: number) => new Promise((resolve) => window.setTimeout(resolve, ms));
+
 export default function ChatInterface() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [input, setInput] = useState("");
-  const [sessionId, setSessionId] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
   const messagesEndRef = useRef<HTMLDivElement | null>(null);
   const [isMobile, setIsMobile] = useState(false);
 
-
-  const API_BASE_URL = "https://verzel-backend-production.up.railway.app";
+  // estado da conexão WebSocket (refs para não recriar a conexão a cada render)
+  const wsRef = useRef<WebSocket | null>(null);
+  const sessionIdRef = useRef<string | null>(null);
+  const lastSeqRef = useRef(0);
+  // versão do histórico a que os seq se referem (muda quando o backend compacta a conversa)
+  const versionRef = useRef("");
+  const syncedRef = useRef(false);
+  const resyncRef = useRef(false);
+  const attemptsRef = useRef(0);
+  const closedRef = useRef(false);
+  const reconnectTimerRef = useRef<number | undefined>(undefined);
+  // mensagens enviadas ainda sem confirmação: request_id -> texto
+  const pendingRef = useRef<Map<string, string>>(new Map());
+  const replayingRef = useRef(false);
 
 
   useEffect(() => {
@@ -27,71 +68,233 @@ export default function ChatInterface() {
     }
   }, []);
 
-  useEffect(() => {
-    const initializeChat = async () => {
-      let currentSessionId = localStorage.getItem("verzel_session_id");
-
-      if (!currentSessionId) {
-        currentSessionId = `visitor_${Date.now()}_${Math.random()
-          .toString(36)
-          .substr(2, 9)}`;
-        localStorage.setItem("verzel_session_id", currentSessionId);
-      }
+  const saveSessionId = (id: string) => {
+    sessionIdRef.current = id;
+    localStorage.setItem("verzel_session_id", id);
+  };
 
-      setSessionId(currentSessionId);
+  // carga do histórico por HTTP, usada quando o WebSocket não conecta
+  const loadHistoryHttp = async (currentSessionId: string | null) => {
+    // o histórico passa a vir por HTTP; o próximo WebSocket recomeça do zero
+    resyncRef.current = true;
 
-      try {
-        const response = await fetch(
-          `${API_BASE_URL}/get_messages?session_id=${currentSessionId}`
-        );
-        const data = await response.json();
-
-        if (data.messages && data.messages.length > 0) {
-          setMessages(data.messages);
-        } else {
-          setMessages([
-            {
-              role: "assistant",
-              content:
-                "Olá! Sou o Roberto, da Verzel. Como posso te ajudar hoje?",
-            },
-          ]);
+    if (!currentSessionId) {
+      setMessages([GREETING]);
+      setLoading(false);
+      return;
+    }
+
+    try {
+      const response = await fetch(
+        `${API_BASE_URL}/get_messages?session_id=${currentSessionId}`
+      );
+      const data = await response.json();
+
+      if (data.messages && data.messages.length > 0) {
+        setMessages(data.messages);
+      } else {
+        setMessages([GREETING]);
+      }
+    } catch (error) {
+      console.error("Erro ao carregar mensagens:", error);
+      setMessages([GREETING]);
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const handleEvent = (ws: WebSocket, event: ServerEvent) => {
+    switch (event.type) {
+      case "session":
+        // sessão nova ou id antigo migrado
+        saveSessionId(event.session_id!);
+        break;
+      case "reset":
+        lastSeqRef.current = 0;
+        versionRef.current = event.versao ?? "";
+        replayingRef.current = true;
+        setMessages([]);
+        break;
+      case "message": {
+        lastSeqRef.current = event.seq!;
+        // a mensagem do próprio usuário já está na tela
+        if (event.request_id && pendingRef.current.delete(event.request_id)) {
+          break;
         }
-      } catch (error) {
-        console.error("Erro ao carregar mensagens:", error);
-        setMessages([
-          {
-            role: "assistant",
-            content:
-              "Olá! Sou o Roberto, da Verzel. Como posso te ajudar hoje?",
-          },
+        // mensagem pendente processada antes de uma reconexão: volta sem request_id
+        const pending = event.role === "user"
+          ? [...pendingRef.current].find(([, text]) => text === event.content)
+          : undefined;
+        if (pending) {
+          pendingRef.current.delete(pending[0]);
+          if (!replayingRef.current) break;
+        }
+        setMessages((prev) => [
+          ...prev,
+          { role: event.role!, content: event.content ?? "" },
         ]);
-      } finally {
+        break;
+      }
+      case "sincronizado": {
+        lastSeqRef.current = event.seq!;
+        versionRef.current = event.versao ?? "";
+        syncedRef.current = true;
+        const pending = [...pendingRef.current];
+        if (replayingRef.current) {
+          // a tela foi limpa: as pendentes voltam para a tela
+          replayingRef.current = false;
+          setMessages((prev) => [
+            ...prev,
+            ...pending.map(([, text]): Message => ({ role: "user", content: text })),
+          ]);
+        }
+        setMessages((prev) => (prev.length > 0 ? prev : [GREETING]));
         setLoading(false);
+        // reenvia as pendentes com a mesma chave: o backend não processa duas vezes
+        for (const [requestId, text] of pending) {
+          ws.send(JSON.stringify({ type: "message", content: text, request_id: requestId }));
+        }
+        break;
+      }
+      case "error":
+        // turno recusado ou com erro: a mensagem deixa de estar pendente
+        if (event.request_id) {
+          pendingRef.current.delete(event.request_id);
+        }
+        setMessages((prev) => [
+          ...prev,
+          { role: "assistant", content: event.detail ?? "Desculpe, não entendi." },
+        ]);
+        break;
+      case "ping":
+        ws.send(JSON.stringify({ type: "pong" }));
+        break;
+      // "etapa" e "pong" não alteram a tela
+    }
+  };
+
+  const connect = () => {
+    if (typeof WebSocket === "undefined") {
+      loadHistoryHttp(sessionIdRef.current);
+      return;
+    }
+
+    if (resyncRef.current) {
+      lastSeqRef.current = 0;
+      versionRef.current = "";
+    }
+    const params = new URLSearchParams({
+      ultimo_seq: String(lastSeqRef.current),
+      versao: versionRef.current,
+    });
+    if (sessionIdRef.current) {
+      params.set("session_id", sessionIdRef.current);
+    }
+
+    const ws = new WebSocket(`${WS_URL}?${params}`);
+    wsRef.current = ws;
+    syncedRef.current = false;
+
+    ws.onopen = () => {
+      attemptsRef.current = 0;
+      if (resyncRef.current) {
+        // mensagens enviadas por HTTP: o histórico completo é reenviado
+        resyncRef.current = false;
+        setMessages([]);
       }
     };
+    ws.onmessage = (e) => handleEvent(ws, JSON.parse(e.data));
+    ws.onclose = (e) => {
+      if (wsRef.current === ws) {
+        wsRef.current = null;
+      }
+      if (closedRef.current || e.code === WS_SUBSTITUIDA) return;
+
+      // primeira conexão falhou: carrega o histórico por HTTP enquanto tenta de novo
+      if (!syncedRef.current && attemptsRef.current === 0 && lastSeqRef.current === 0) {
+        loadHistoryHttp(sessionIdRef.current);
+      }
+      const delay = Math.min(30000, 1000 * 2 ** attemptsRef.current);
+      attemptsRef.current += 1;
+      reconnectTimerRef.current = window.setTimeout(connect, delay);
+    };
+  };
 
-    initializeChat();
+  useEffect(() => {
+    // o session_id é gerado pelo backend na primeira mensagem
+    const currentSessionId = localStorage.getItem("verzel_session_id");
+    sessionIdRef.current = currentSessionId;
+    closedRef.current = false;
+
+    connect();
+
+    return () => {
+      closedRef.current = true;
+      window.clearTimeout(reconnectTimerRef.current);
+      wsRef.current?.close();
+    };
   }, []);
 
+  // envia por HTTP, repetindo com a mesma chave quando a falha é temporária
+  const postHttp = async (text: string, requestId: string) => {
+    for (let attempt = 1; ; attempt++) {
+      const currentSessionId = sessionIdRef.current;
+      const sessionParam = currentSessionId ? `&session_id=${currentSessionId}` : "";
+      try {
+        const response = await fetch(
+          `${API_BASE_URL}/input_message?message_received=${encodeURIComponent(
+            text
+          )}${sessionParam}&request_id=${requestId}`
+        );
+        if (!RETRY_STATUS.includes(response.status) || attempt >= HTTP_TENTATIVAS) {
+          return { currentSessionId, data: await response.json() };
+        }
+        const retryAfter = Number(response.headers.get("Retry-After")) || attempt;
+        await sleep(retryAfter * 1000);
+      } catch (error) {
+        if (attempt >= HTTP_TENTATIVAS) throw error;
+        await sleep(1000 * attempt);
+      }
+    }
+  };
+
   const sendMessage = async () => {
-    if (!input.trim() || !sessionId) return;
+    if (!input.trim()) return;
 
-    const userMessage: Message = { role: "user", content: input };
+    const text = input;
+    // clique/Enter repetido antes da resposta: a mensagem já está a caminho
+    if ([...pendingRef.current.values()].includes(text)) return;
+
+    const userMessage: Message = { role: "user", content: text };
     setMessages((prev) => [...prev, userMessage]);
     setInput("");
 
+    // chave de idempotência criada uma vez por mensagem e reaproveitada nos reenvios:
+    // o backend responde a repetição sem processar de novo
+    const requestId = crypto.randomUUID();
+    pendingRef.current.set(requestId, text);
+
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN && syncedRef.current) {
+      // a resposta chega como evento "message"; se a conexão cair antes, a
+      // mensagem é reenviada com a mesma chave depois da reconexão
+      ws.send(JSON.stringify({ type: "message", content: text, request_id: requestId }));
+      return;
+    }
+
+    // sem WebSocket: envia por HTTP
+    resyncRef.current = true;
     try {
-      const response = await fetch(
-        `${API_BASE_URL}/input_message?message_received=${encodeURIComponent(
-          input
-        )}&session_id=${sessionId}`
-      );
-      const data = await response.json();
+      const { currentSessionId, data } = await postHttp(text, requestId);
+
+      // sessão nova ou id antigo migrado: guarda o id devolvido pelo backend
+      if (data.session_id && data.session_id !== currentSessionId) {
+        saveSessionId(data.session_id);
+      }
 
       const assistantMessage: Message = {
         role: "assistant",
-        content: data.response || "Desculpe, não entendi.",
+        content: data.response || data.detail || "Desculpe, não entendi.",
       };
 
       setMessages((prev) => [...prev, assistantMessage]);
@@ -101,6 +304,8 @@ export default function ChatInterface() {
         ...prev,
         { role: "assistant", content: "Erro ao conectar com o servidor." },
       ]);
+    } finally {
+      pendingRef.current.delete(requestId);
     }
   };
 